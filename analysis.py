@@ -0,0 +1,126 @@
+"""Spectral analysis of signals, the results are drawn by plot.py.
+
+The spectra of long signals are computed with the FFT in O(n log n), and StreamingSpectrum
+updates a Welch PSD and a spectrogram block by block, as the signal arrives.
+"""
+import numpy as np
+import scipy.fft
+import scipy.signal
+
+import windowing
+
+
+def autocorr(x):
+    """Returns the autocorrelation of x for the lags 0 to len(x) - 1, normalized by the lag
+    0, same as np.correlate(x, x, mode='full') but in O(n log n).
+    """
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+
+    # zero padded to 2n - 1 at least, so that the circular correlation is linear
+    nfft = scipy.fft.next_fast_len(2*n - 1, real=True)
+    f = scipy.fft.rfft(x, nfft)
+    result = scipy.fft.irfft(f.real**2 + f.imag**2, nfft)[:n]
+    return result / result[0]
+
+
+def amplitude_spectrum(signal, sampling_period):
+    """Returns the frequencies and the amplitudes of the one-sided spectrum of signal, for
+    the len(signal) // 2 first frequencies.
+    """
+    n = len(signal)
+    frequencies = scipy.fft.rfftfreq(n, sampling_period)[:n//2]
+    amplitudes = 2.0/n * np.abs(scipy.fft.rfft(signal, axis=0)[:n//2])
+    return frequencies, amplitudes
+
+
+class StreamingSpectrum(object):
+    """Welch power spectral density and spectrogram of a signal given block by block.
+
+    The signal is cut in segments of nperseg samples overlapping by noverlap, each one
+    detrended, windowed and transformed once it is complete. update returns the spectra of
+    the new segments, the columns of the spectrogram, and psd is their mean: the same as
+    scipy.signal.welch and scipy.signal.spectrogram over the signal received so far, with
+    scaling='density'. The window and the scaling are computed once, and the FFT plans
+    of the segment length are cached by scipy.fft.
+
+    Args:
+        fs (float): sampling frequency.
+        window (str or tuple): window of the segments, see scipy.signal.get_window.
+        nperseg (int): length of a segment.
+        noverlap (int): number of samples shared by consecutive segments, nperseg // 2
+            by default.
+        detrend (str): 'constant' to remove the mean of each segment, or False.
+    """
+    def __init__(self, fs=1.0, window='hann', nperseg=256, noverlap=None, detrend='constant'):
+        super(StreamingSpectrum, self).__init__()
+
+        if noverlap is None:
+            noverlap = nperseg // 2
+        if detrend not in ('constant', False):
+            raise ValueError("unknown detrend {}, expected 'constant' or False".format(detrend))
+
+        self.fs = fs
+        self.nperseg = nperseg
+        self.step = nperseg - noverlap
+        self.detrend = detrend
+
+        self.window = scipy.signal.get_window(window, nperseg)
+        self.freqs = scipy.fft.rfftfreq(nperseg, 1.0/fs)
+
+        # density scaling, doubled for the frequencies folded from the negative side
+        self._scale = np.full(len(self.freqs), 2.0 / (fs * (self.window**2).sum()))
+        self._scale[0] /= 2
+        if nperseg % 2 == 0:
+            self._scale[-1] /= 2
+
+        # samples of the segments not complete yet, and where they start in the signal
+        self._carry = None
+        self._start = 0
+
+        self._sum = 0
+        self.n_segments = 0
+
+    def update(self, block):
+        """Add a block of samples, of shape (n, ...) with the same trailing shape for all
+        blocks.
+
+        Returns:
+            times (array): time of the middle of each new segment.
+            spectra (array): power spectral density of each new segment, of shape
+                (n_segments, len(freqs), ...).
+        """
+        block = np.asarray(block, dtype=float)
+        data = block if self._carry is None else np.concatenate([self._carry, block])
+
+        segments = windowing.sliding_windows(data, self.nperseg, self.step)
+        n = len(segments)
+
+        times = (self._start + np.arange(n) * self.step + self.nperseg / 2.0) / self.fs
+        spectra = self._periodograms(segments)
+
+        self._carry = data[n * self.step:].copy()
+        self._start += n * self.step
+
+        if n:
+            self._sum = self._sum + spectra.sum(axis=0)
+            self.n_segments += n
+        return times, spectra
+
+    def _periodograms(self, segments):
+        if self.detrend == 'constant':
+            segments = segments - segments.mean(axis=1, keepdims=True)
+
+        shape = (1, self.nperseg) + (1,) * (segments.ndim - 2)
+        spectrum = scipy.fft.rfft(segments * self.window.reshape(shape), axis=1)
+
+        scale = self._scale.reshape((1, len(self.freqs)) + (1,) * (segments.ndim - 2))
+        return (spectrum.real**2 + spectrum.imag**2) * scale
+
+    @property
+    def psd(self):
+        """Mean power spectral density of the segments so far, of shape (len(freqs), ...).
+        """
+        if not self.n_segments:
+            return None
+        return self._sum / self.n_segments
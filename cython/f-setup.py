@@ -26,6 +26,14 @@ ext_modules = [Extension(
         # libraries=
         # extra_compile_args = "...".split(),
         # extra_link_args = "...".split()
+    ),
+    # AxisFilter.new_sample of functional.py, copy functional_c.so next to functional.py
+    Extension(
+    name="functional_c",
+    sources=["functional_c.pyx", "functional_kernels.cpp"],
+    include_dirs = [numpy.get_include()],
+    language="c++",
+    extra_compile_args = ["-O3"],
     )]
 
 setup(
@@ -40,3 +48,4 @@ setup(
     )
 
 # test: import f
+# test: python test-functional.py, compares functional_c with the numpy code
@@ -0,0 +1,130 @@
+# functional_c.pyx: compiled kernels for functional.py -> extern from "functional_kernels.h"
+# python f-setup.py build_ext --inplace  -> functional_c.so, then put it next to functional.py
+#
+# AxisFilterKernel runs functional.AxisFilter.new_sample in one call: interpolation,
+# low-pass filter and Savitzky-Golay fit of all the steps of a sample, with the GIL
+# released. The arrays of the chain are bound once, the block paths stay in numpy/scipy.
+
+import numpy as np
+cimport numpy as np
+
+cdef extern from "functional_kernels.h" nogil:
+    struct AxisFilterState:
+        int m
+        double stepsize
+        double last_time
+        double* last_value
+        const double* B
+        int nb
+        const double* A
+        int na
+        double* xbuf
+        int xhead
+        double* ybuf
+        int yhead
+        const double* sos
+        int n_sections
+        double* zi
+        const double* coeffs
+        int d
+        int w
+        double* wbuf
+        int whead
+        double* scratch
+
+    int axis_filter_steps( const AxisFilterState* s, double time )
+    int axis_filter_sample( AxisFilterState* s, double time, const double* value, double* out )
+
+
+cdef class AxisFilterKernel:
+    """ state of an AxisFilter of m channels, on the arrays of its python objects:
+        the buffers of IIRFilter (B, A, xbuf, ybuf) or the sos and zi of SOSFilter, and the
+        coeffs and window of SavitskyGolayFitter. load and state move the scalar state,
+        the interpolation and the ring buffer heads, in and out. """
+    cdef AxisFilterState s
+    cdef double[::1] _B, _A, _last_value, _scratch, _value
+    cdef double[:, ::1] _xbuf, _ybuf, _sos, _coeffs, _wbuf
+    cdef double[:, :, ::1] _zi
+    cdef readonly int width
+
+    def __init__( self, double stepsize, int m, double[:, ::1] coeffs, double[:, ::1] wbuf,
+        double[::1] B=None, double[::1] A=None, double[:, ::1] xbuf=None, double[:, ::1] ybuf=None,
+        double[:, ::1] sos=None, double[:, :, ::1] zi=None ):
+
+        assert wbuf.shape[0] == 2*coeffs.shape[1] and wbuf.shape[1] == m
+        self._coeffs, self._wbuf = coeffs, wbuf
+        self._last_value = np.zeros(m)
+        self._scratch = np.zeros(3*m)
+        self._value = np.zeros(m)
+
+        self.s.m = m
+        self.s.stepsize = stepsize
+        self.s.last_time = 0
+        self.s.last_value = &self._last_value[0]
+        self.s.coeffs = &coeffs[0, 0]
+        self.s.d = coeffs.shape[0]
+        self.s.w = coeffs.shape[1]
+        self.s.wbuf = &wbuf[0, 0]
+        self.s.whead = 0
+        self.s.scratch = &self._scratch[0]
+        self.width = 1 + self.s.d * m
+
+        if sos is not None:
+            assert sos.shape[1] == 6 and zi.shape[0] == sos.shape[0] and zi.shape[1] == 2
+            assert zi.shape[2] == m
+            self._sos, self._zi = sos, zi
+            self.s.sos = &sos[0, 0]
+            self.s.n_sections = sos.shape[0]
+            self.s.zi = &zi[0, 0, 0]
+        else:
+            assert xbuf.shape[0] == 2*B.shape[0] and ybuf.shape[0] == 2*(A.shape[0] - 1)
+            assert xbuf.shape[1] == ybuf.shape[1] == m
+            self._B, self._A, self._xbuf, self._ybuf = B, A, xbuf, ybuf
+            self.s.sos = NULL
+            self.s.B = &B[0]
+            self.s.nb = B.shape[0]
+            self.s.A = &A[0]
+            self.s.na = A.shape[0]
+            self.s.xbuf = &xbuf[0, 0]
+            self.s.ybuf = &ybuf[0, 0] if ybuf.shape[0] else NULL
+            self.s.xhead = 0
+            self.s.yhead = 0
+
+    def load( self, double last_time, const double[::1] last_value,
+            int xhead, int yhead, int whead ):
+        """ set the last sample of the interpolation and the ring buffer heads """
+        assert last_value.shape[0] == self.s.m
+        self.s.last_time = last_time
+        self._last_value[:] = last_value
+        self.s.xhead, self.s.yhead, self.s.whead = xhead, yhead, whead
+
+    def state( self ):
+        """ return (last_time, last_value, xhead, yhead, whead) """
+        return (self.s.last_time, np.array(self._last_value), self.s.xhead, self.s.yhead,
+                self.s.whead)
+
+    cpdef int steps( self, double time ):
+        """ number of rows new_sample writes for a sample at time """
+        return axis_filter_steps( &self.s, time )
+
+    def new_sample( self, double time, value, double[:, ::1] out ):
+        """ filter the sample (time, value), value of m channels or a float, write the rows
+            to out, of at least steps(time) rows and width columns, return their number """
+        cdef int n
+        cdef const double[::1] v
+        cdef double* rows = NULL
+        if isinstance( value, float ) or self.s.m == 1 and np.ndim( value ) == 0:
+            self._value[0] = value
+            v = self._value
+        elif isinstance( value, np.ndarray ) and value.dtype == np.float64 \
+                and value.flags.c_contiguous:
+            v = value
+        else:
+            v = np.ascontiguousarray( value, dtype=float ).reshape( -1 )
+        assert v.shape[0] == self.s.m
+        assert out.shape[1] == self.width and out.shape[0] >= axis_filter_steps( &self.s, time )
+        if out.shape[0]:
+            rows = &out[0, 0]
+        with nogil:
+            n = axis_filter_sample( &self.s, time, &v[0], rows )
+        return n
@@ -0,0 +1,157 @@
+// functional_kernels.cpp: ring buffer, IIR and Savitzky-Golay kernels, numpy arrays from cython
+
+#include <math.h>
+
+#include "functional_kernels.h"
+
+// write the m values of x at head and head + n, return the next head
+int ring_write( int n, int m, double buf[], int head, const double x[] )
+{
+    for( int c = 0;  c < m;  c ++ ){
+        buf[head*m + c] = x[c];
+        buf[(head + n)*m + c] = x[c];
+    }
+    return (head + 1) % n;
+}
+
+// direct form I, previous inputs (nb rows) and outputs (na - 1 rows) in mirrored ring buffers
+void iir_df1( int k, int m, const double B[], int nb, const double A[], int na,
+              double xbuf[], int* xhead, double ybuf[], int* yhead,
+              const double x[], double y[] )
+{
+    int ny = na - 1;
+    for( int i = 0;  i < k;  i ++ ){
+        *xhead = ring_write( nb, m, xbuf, *xhead, x + i*m );
+
+        // oldest sample first, the newest is the last row of the window
+        const double* xw = xbuf + (*xhead)*m;
+        const double* yw = ybuf + (*yhead)*m;
+
+        for( int c = 0;  c < m;  c ++ ){
+            double num = 0, den = 0;
+            for( int j = 0;  j < nb;  j ++ ){
+                num += B[j] * xw[(nb - 1 - j)*m + c];
+            }
+            for( int j = 1;  j < na;  j ++ ){
+                den += A[j] * yw[(ny - j)*m + c];
+            }
+            y[i*m + c] = (num - den) / A[0];
+        }
+
+        if( ny > 0 ){
+            *yhead = ring_write( ny, m, ybuf, *yhead, y + i*m );
+        }
+    }
+}
+
+// cascade of second order sections, transposed direct form II, zi of shape (n_sections, 2, m)
+void sos_filter( int k, int m, const double sos[], int n_sections, double zi[],
+                 const double x[], double y[] )
+{
+    for( int i = 0;  i < k;  i ++ ){
+        for( int c = 0;  c < m;  c ++ ){
+            double xc = x[i*m + c];
+            for( int s = 0;  s < n_sections;  s ++ ){
+                const double* b = sos + 6*s;
+                double* z0 = zi + (2*s)*m + c;
+                double* z1 = zi + (2*s + 1)*m + c;
+
+                double yc = b[0]*xc + *z0;
+                *z0 = b[1]*xc - b[4]*yc + *z1;
+                *z1 = b[2]*xc - b[5]*yc;
+                xc = yc;
+            }
+            y[i*m + c] = xc;
+        }
+    }
+}
+
+// write each sample to the window and dot it with the d rows of coeffs, out of shape (k, d, m)
+int sg_filter( int k, int m, const double coeffs[], int d, int w,
+               double wbuf[], int head, const double x[], double out[] )
+{
+    for( int i = 0;  i < k;  i ++ ){
+        head = ring_write( w, m, wbuf, head, x + i*m );
+        const double* window = wbuf + head*m;
+
+        for( int r = 0;  r < d;  r ++ ){
+            for( int c = 0;  c < m;  c ++ ){
+                double acc = 0;
+                for( int j = 0;  j < w;  j ++ ){
+                    acc += coeffs[r*w + j] * window[j*m + c];
+                }
+                out[(i*d + r)*m + c] = acc;
+            }
+        }
+    }
+    return head;
+}
+
+// a % b of python floats, with the sign of b
+static double py_mod( double a, double b )
+{
+    double r = fmod( a, b );
+    if( r != 0 ){
+        if( (b < 0) != (r < 0) )  r += b;
+    }
+    else r = copysign( 0.0, b );
+    return r;
+}
+
+// first time step after the last sample, see StepInterpolator._starttime
+static double start_time( const AxisFilterState* s )
+{
+    return s->last_time + py_mod( s->stepsize - s->last_time, s->stepsize );
+}
+
+// number of rows axis_filter_sample writes for a sample at time
+int axis_filter_steps( const AxisFilterState* s, double time )
+{
+    double n = ceil( (time - start_time( s )) / s->stepsize );
+    return n > 0 ? (int) n : 0;
+}
+
+// AxisFilter.new_sample: interpolate the steps up to time, excluded, same arithmetic as
+// StepInterpolator, low-pass filter and fit each of them. out has 1 + d*m columns, the
+// time step followed by the d derivatives of the m channels. Returns the number of rows.
+int axis_filter_sample( AxisFilterState* s, double time, const double value[], double out[] )
+{
+    int m = s->m;
+    int width = 1 + s->d * m;
+    int n = axis_filter_steps( s, time );
+    double* x = s->scratch;
+    double* y = s->scratch + m;
+    double* slope = s->scratch + 2*m;
+
+    double start = start_time( s );
+    double delta = (start + s->stepsize) - start;
+    if( n ){
+        for( int c = 0;  c < m;  c ++ ){
+            slope[c] = (value[c] - s->last_value[c]) / (time - s->last_time);
+        }
+    }
+
+    for( int i = 0;  i < n;  i ++ ){
+        double t = start + i*delta;
+        out[i*width] = t;
+        for( int c = 0;  c < m;  c ++ ){
+            x[c] = slope[c]*(t - s->last_time) + s->last_value[c];
+        }
+
+        if( s->sos ){
+            sos_filter( 1, m, s->sos, s->n_sections, s->zi, x, y );
+        }
+        else {
+            iir_df1( 1, m, s->B, s->nb, s->A, s->na, s->xbuf, &s->xhead, s->ybuf, &s->yhead, x, y );
+        }
+
+        s->whead = sg_filter( 1, m, s->coeffs, s->d, s->w, s->wbuf, s->whead, y,
+                              out + i*width + 1 );
+    }
+
+    s->last_time = time;
+    for( int c = 0;  c < m;  c ++ ){
+        s->last_value[c] = value[c];
+    }
+    return n;
+}
@@ -0,0 +1,43 @@
+// functional_kernels.h: per-sample kernels of functional.py, double*
+//
+// Arrays are row-major, with m channels per row. A mirrored ring buffer of n rows
+// is stored twice, 2n rows, so that the window starting at head is contiguous.
+
+int ring_write( int n, int m, double buf[], int head, const double x[] );
+
+void iir_df1( int k, int m, const double B[], int nb, const double A[], int na,
+              double xbuf[], int* xhead, double ybuf[], int* yhead,
+              const double x[], double y[] );
+
+void sos_filter( int k, int m, const double sos[], int n_sections, double zi[],
+                 const double x[], double y[] );
+
+int sg_filter( int k, int m, const double coeffs[], int d, int w,
+               double wbuf[], int head, const double x[], double out[] );
+
+// state of functional.AxisFilter: step interpolation, low-pass filter (difference
+// equation when sos is NULL, second order sections otherwise) and Savitzky-Golay fit.
+// The arrays belong to the python objects of the chain.
+struct AxisFilterState {
+    int m;
+    double stepsize;
+    double last_time;
+    double* last_value;     // m
+
+    const double* B;  int nb;
+    const double* A;  int na;
+    double* xbuf;  int xhead;
+    double* ybuf;  int yhead;
+
+    const double* sos;  int n_sections;
+    double* zi;
+
+    const double* coeffs;  int d;  int w;
+    double* wbuf;  int whead;
+
+    double* scratch;        // 3m
+};
+
+int axis_filter_steps( const AxisFilterState* s, double time );
+
+int axis_filter_sample( AxisFilterState* s, double time, const double value[], double out[] );
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# test-functional.py: AxisFilter.new_sample with functional_c against the numpy code, and
+# timing of functional.py with and without it. Run from this directory after
+# f-setup.py build_ext --inplace.
+
+import sys
+import timeit
+
+import numpy as np
+
+import functional_c  # loads functional_c.so: functional_c.pyx + functional_kernels.cpp
+
+sys.path.insert(0, "..")
+import functional
+
+times = np.cumsum(np.random.uniform(5, 15, 2000))
+values = np.random.randn(len(times), 3).cumsum(axis=0)
+
+# the same stream, sample by sample, then resumed with batch_filter
+for engine in ("ba", "sos"):
+    for channels in (None, 3):
+        v = values[:, 0] if channels is None else values
+        out = []
+        for kernels in (functional_c, None):
+            functional._kernels = kernels
+            af = functional.AxisFilter(channels=channels, engine=engine)
+            rows = [af.new_sample(t, x) for t, x in zip(times[:1000], v[:1000])]
+            rows.append(af.batch_filter(times[1000:], v[1000:]))
+            out.append(np.concatenate(rows))
+        print("{:>3} channels={}: max error {:.2e}".format(
+            engine, channels, np.abs(out[0] - out[1]).max()))
+
+# per-sample and per-block time of the whole chain, compiled then numpy
+for kernels in (functional_c, None):
+    functional._kernels = kernels
+    af = functional.AxisFilterBank(3, stepsize=1, reuse_output=True)
+    t = iter(range(1, 10**7))
+    value = np.ones(3)
+    per_sample = min(timeit.repeat(lambda: af.new_sample(next(t), value), number=2000, repeat=3)) / 2000
+    times = np.arange(1, 10**6)
+    values = np.random.randn(len(times), 3)
+    per_block = min(timeit.repeat(
+        lambda: functional.AxisFilterBank(3, stepsize=1).batch_filter(times, values), number=1, repeat=3))
+    print("{:>9}: {:.2f} us per sample, {:.3f} s per 1e6 samples".format(
+        "compiled" if kernels else "numpy", per_sample * 1e6, per_block))
@@ -1,8 +1,19 @@
+import collections
+import concurrent.futures
+import os
+import tempfile
 import time
+import timeit
 
 import numpy as np
 import pandas as pd
 
+try:
+    # compiled AxisFilter.new_sample, see cython/f-setup.py
+    import functional_c as _kernels
+except ImportError:
+    _kernels = None
+
 
 class AxisFilter(object):
     """Filter an axis with given time step, fits a polynomial of given order and returns
@@ -13,53 +24,312 @@ class AxisFilter(object):
         window_length (int): length of the window over which to fit the polynom, odd number.
         polyorder (int): order of the polynomial to fit.
         derivative_number (int): number of derivatives of the signals to return.
+        reuse_output (bool): new_sample returns a view into an internal buffer instead of
+            a new array, so that the streaming path does not allocate.
+        channels (int): number of axes filtered together, see AxisFilterBank. None for a
+            single axis with scalar values.
+
+    When the functional_c extension is built, new_sample runs the whole chain in one
+    compiled call, on the arrays of si, lpf and sgf. The compiled kernel then holds the
+    last sample of si and the positions of the ring buffers, written back by
+    batch_filter.
     """
-    def __init__(self, stepsize=10, window_length=11, polyorder=3, derivative_number=1, **kwargs):
+    def __init__(self, stepsize=10, window_length=11, polyorder=3, derivative_number=1,
+        reuse_output=False, channels=None, **kwargs):
         super(AxisFilter, self).__init__()
 
         self.stepsize = stepsize
         self.window_length = window_length
         self.polyorder = polyorder
         self.derivative_number = derivative_number
+        self.channels = channels
+
+        # time stamp, followed by the derivatives of every channel
+        if channels is None:
+            self._deriv_shape = (derivative_number + 1,)
+        else:
+            self._deriv_shape = (derivative_number + 1, channels)
+        self._width = 1 + int(np.prod(self._deriv_shape))
+
+        self.reuse_output = reuse_output
+        self._out = np.empty((1, self._width))
 
         # perform constant time sampling through linear interpolation
         self.si = StepInterpolator(stepsize)
 
         # low-pass filter
         # sampling_frequency = 1e3/stepsize
-        self.lpf = LowPassFilter(sampling_frequency = 1.e3/stepsize, **kwargs)
+        self.lpf = LowPassFilter(sampling_frequency = 1.e3/stepsize, channels=channels, **kwargs)
 
         # we do not compensate for h in sgf
-        self.sgf = SavitskyGolayFitter(window_length, polyorder, derivative_number)
+        self.sgf = SavitskyGolayFitter(window_length, polyorder, derivative_number, channels=channels)
 
+        # compiled state of the chain while new_sample runs in functional_c, see _load_kernel
+        self._kernel = None
 
-    def new_sample(self, time, value):
+
+    def new_sample(self, time, value, out=None):
         """Filter a new sample.
 
+        The interpolated points are written directly into the output array, whose number
+        of rows is given by StepInterpolator.step_count.
+
         Args:
             time (): timestamp in ms
             value (): value at the timestamp
+            out (array): optional array to write the result to, with at least k rows and
+                derivative_number + 2 columns, or more with channels. It may be strided.
 
         Returns:
+            view of shape (k, derivative_number + 2), time stamp followed by the derivatives.
+            For several channels, the derivatives of order 0 of all channels come first,
+            then order 1, and so on.
+            With reuse_output, the view is overwritten by the next call.
+        """
+        if _kernels is not None:
+            kernel = self._kernel if self._kernel is not None else self._load_kernel()
+            n = kernel.steps(time)
+        else:
+            n = self.si.step_count(time)
+
+        if out is None:
+            out = self._output_buffer(n)
+        elif np.ndim(out) != 2 or np.shape(out)[1] != self._width:
+            raise ValueError("out must have {} columns, got shape {}".format(
+                self._width, np.shape(out)))
+        elif len(out) < n:
+            raise ValueError("out has {} rows, {} needed".format(len(out), n))
+
+        # the stages write to C-contiguous rows, copied to out if it is strided
+        ns = out[:n]
+        rows = ns if ns.flags.c_contiguous else np.empty(ns.shape)
+
+        if _kernels is not None:
+            kernel.new_sample(time, value, rows)
+        else:
+            self._filter_steps(time, value, rows)
+
+        if rows is not ns:
+            np.copyto(ns, rows)
+        return ns
 
+    def _filter_steps(self, time, value, rows):
+        """Run the chain stage by stage, writing its rows for the sample to rows.
+        """
+        channels = self.channels
+        self.si.new_sample(time, value, out=rows[:, :1 + (channels or 1)])
+
+        for i in range(len(rows)):
+            if channels is None:
+                point = self.lpf.new_sample(rows[i, 1])
+            else:
+                point = self.lpf.new_sample(rows[i, 1:1 + channels])
+            self.sgf.new_sample(point, out=rows[i, 1:].reshape(self._deriv_shape))
+
+    def _load_kernel(self):
+        """Returns the compiled kernel of the chain, on the arrays of si, lpf and sgf,
+        from their current state.
+        """
+        m = self.channels or 1
+        iir = self.lpf.iir
+        rb = self.sgf.rb
+
+        if isinstance(iir, SOSFilter):
+            self._kernel = _kernels.AxisFilterKernel(self.si.stepsize, m, self.sgf.conv_coeffs,
+                rb._samples, sos=iir.sos, zi=iir.zi.reshape(len(iir.sos), 2, m))
+            heads = (0, 0)
+        else:
+            self._kernel = _kernels.AxisFilterKernel(self.si.stepsize, m, self.sgf.conv_coeffs,
+                rb._samples, B=iir.B, A=iir.A, xbuf=iir.prev_inputs._samples,
+                ybuf=iir.prev_outputs._samples)
+            heads = (iir.prev_inputs.write_head, iir.prev_outputs.write_head)
+            # the kernel moves the buffers away from the last lfilter state
+            iir._zf = None
+
+        last_value = np.broadcast_to(np.asarray(self.si.last_value, dtype=float), (m,))
+        self._kernel.load(self.si.last_time, np.ascontiguousarray(last_value), heads[0], heads[1],
+            rb.write_head)
+        return self._kernel
+
+    def _unload_kernel(self):
+        """Write the state held by the compiled kernel back to si, lpf and sgf.
+        """
+        if self._kernel is None:
+            return
+
+        last_time, last_value, xhead, yhead, whead = self._kernel.state()
+        self._kernel = None
+
+        self.si.last_time = last_time
+        self.si.last_value = last_value[0] if self.channels is None else last_value
+        iir = self.lpf.iir
+        if isinstance(iir, IIRFilter):
+            iir.prev_inputs._move_head(xhead)
+            if iir.prev_outputs.n_samples:
+                iir.prev_outputs._move_head(yhead)
+        self.sgf.rb._move_head(whead)
+
+    def _output_buffer(self, n):
+        """Returns an output array of at least n rows, reused across calls with reuse_output.
         """
-        interp = self.si.new_sample(time, value)
+        if not self.reuse_output:
+            return np.empty((n, self._width))
 
-        ns = np.zeros((0,self.derivative_number + 2)) # 0th order is 1 sample, and add time stamp
+        if len(self._out) < n:
+            self._out = np.empty((max(n, 2*len(self._out)), self._width))
+        return self._out
 
-        for t, point in interp:
-            point = self.lpf.new_sample(point)
-            ns = np.vstack([ns, np.r_[t, self.sgf.new_sample(point)]])
 
-        return ns
+    def batch_filter(self, times, values):
+        """Filter a whole recording at once.
 
+        Each stage of the chain runs over the full array instead of sample by sample. The
+        output matches successive calls to new_sample (up to floating point rounding) and
+        the filter state is kept, so that streaming can resume afterwards.
 
-    def batch_filter(self, times, values):
-        xy_ = []
-        for xy in zip(times, values):
-            xy_.append(self.new_sample(*xy))
-        xy_ = np.vstack(xy_)
-        return xy_
+        Args:
+            times (array): timestamps in ms
+            values (array): values at the timestamps
+
+        Returns:
+            array of shape (k, derivative_number + 2), time stamp followed by the derivatives.
+        """
+        self._unload_kernel()
+
+        interp = self.si.process(times, values)
+        if self.channels is None:
+            points = self.lpf.process(interp[:, 1])
+        else:
+            points = self.lpf.process(interp[:, 1:])
+        derivs = self.sgf.process(points)
+        return np.c_[interp[:, 0], derivs.reshape(len(derivs), self._width - 1)]
+
+
+class AxisFilterBank(AxisFilter):
+    """Filter several axes sampled at the same timestamps, for instance the 3 axes of an
+    accelerometer, with one matrix operation per step for all channels.
+
+    new_sample takes a timestamp and a vector of channels values, and returns rows with the
+    time stamp, followed by the derivatives of order 0 of all channels, then order 1, etc.
+
+    Args:
+        channels (int): number of axes.
+        see AxisFilter for the other arguments.
+    """
+    def __init__(self, channels, stepsize=10, window_length=11, polyorder=3, derivative_number=1,
+        reuse_output=False, **kwargs):
+        super(AxisFilterBank, self).__init__(stepsize, window_length, polyorder, derivative_number,
+            reuse_output, channels=channels, **kwargs)
+
+
+# duration of a task of parallel_batch_filter, and the process that ran it
+TaskTiming = collections.namedtuple('TaskTiming', 'recording channels seconds pid')
+
+
+def _batch_filter_task(times_path, values_path, columns, out_path, filter_kwargs):
+    """Filter the columns of the values in values_path, None for 1-d values, and save the
+    output to out_path. Runs in a worker process.
+    """
+    start = time.time()
+
+    times = np.load(times_path, mmap_mode='r')
+    values = np.load(values_path, mmap_mode='r')
+    if columns is not None:
+        values = values[:, columns]
+
+    channels = None if values.ndim == 1 else values.shape[1]
+    out = AxisFilter(channels=channels, **filter_kwargs).batch_filter(times, values)
+    np.save(out_path, out)
+
+    return time.time() - start, os.getpid()
+
+
+def _merge_channel_groups(outputs, derivative_number):
+    """Returns the output of batch_filter over all channels, from the outputs over groups
+    of channels.
+    """
+    derivs = [o[:, 1:].reshape(len(o), derivative_number + 1, -1) for o in outputs]
+    derivs = np.concatenate(derivs, axis=2)
+    return np.c_[outputs[0][:, 0], derivs.reshape(len(derivs), -1)]
+
+
+def parallel_batch_filter(recordings, channel_groups=None, max_workers=None, tmpdir=None,
+    **filter_kwargs):
+    """Run AxisFilter.batch_filter over many recordings in a pool of processes.
+
+    The inputs and outputs go through .npy files memory-mapped by the workers, only their
+    paths are pickled. The results are the same as calling batch_filter on each recording
+    in turn, with AxisFilter(channels=n_columns, **filter_kwargs) for 2-d values.
+
+    Args:
+        recordings (list): (times, values) pairs, or paths of .npy files holding the
+            times in their first column and the values in the others.
+        channel_groups (int): filter at most channel_groups channels of a recording per
+            task, to spread recordings with many channels over several processes.
+        max_workers (int): number of processes, the number of cores by default.
+        tmpdir (str): directory of the temporary files, see tempfile.
+        filter_kwargs: arguments of AxisFilter.
+
+    Returns:
+        results (list): the output of batch_filter for each recording, in order.
+        timings (list): a TaskTiming per task, in order.
+    """
+    derivative_number = filter_kwargs.get('derivative_number', 1)
+
+    with tempfile.TemporaryDirectory(dir=tmpdir) as directory:
+
+        # (recording, columns, times path, values path, number of samples) per task
+        tasks = []
+        for i, recording in enumerate(recordings):
+            if isinstance(recording, str):
+                data = np.load(recording, mmap_mode='r')
+                times_path = os.path.join(directory, "times-{}.npy".format(i))
+                np.save(times_path, data[:, 0])
+                values_path = recording
+                columns = list(range(1, data.shape[1]))
+                if len(columns) == 1:
+                    columns = 1
+            else:
+                times, values = recording
+                times_path = os.path.join(directory, "times-{}.npy".format(i))
+                values_path = os.path.join(directory, "values-{}.npy".format(i))
+                np.save(times_path, times)
+                np.save(values_path, values)
+                data = np.load(values_path, mmap_mode='r')
+                columns = None if data.ndim == 1 else list(range(data.shape[1]))
+
+            if channel_groups is None or not isinstance(columns, list):
+                groups = [columns]
+            else:
+                groups = [columns[k:k + channel_groups] for k in range(0, len(columns), channel_groups)]
+
+            for group in groups:
+                tasks.append((i, group, times_path, values_path, len(data)))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            # longest first, so that the workers finish together
+            futures = {}
+            for k in sorted(range(len(tasks)), key=lambda k: -tasks[k][4]):
+                i, group, times_path, values_path, n = tasks[k]
+                out_path = os.path.join(directory, "out-{}.npy".format(k))
+                futures[k] = (out_path, executor.submit(_batch_filter_task, times_path, values_path,
+                    group, out_path, filter_kwargs))
+
+            outputs = collections.defaultdict(list)
+            timings = []
+            for k, (i, group, times_path, values_path, n) in enumerate(tasks):
+                out_path, future = futures[k]
+                seconds, pid = future.result()
+                outputs[i].append(np.load(out_path))
+                timings.append(TaskTiming(i, group, seconds, pid))
+
+    results = []
+    for i in range(len(recordings)):
+        if len(outputs[i]) == 1:
+            results.append(outputs[i][0])
+        else:
+            results.append(_merge_channel_groups(outputs[i], derivative_number))
+    return results, timings
 
 
 class StepInterpolator(object):
@@ -77,16 +347,80 @@ class StepInterpolator(object):
         self.time_steps = np.zeros(1)
         self.value_steps = np.zeros(1)
 
-    def new_sample(self, time, value):
+    def new_sample(self, time, value, out=None):
+        """Returns the interpolated (time, value) points up to time, excluded.
 
-        starttime = self.last_time + (self.stepsize - self.last_time)%self.stepsize
+        If out is given, the points are written to its first rows and a view is returned.
+        """
+        starttime = self._starttime()
         endtime = time
 
-        self.time_steps = np.arange(starttime, endtime, self.stepsize)
-        self.value_steps = np.interp(self.time_steps, [self.last_time, time], [self.last_value, value])
+        if out is None and np.ndim(value) == 0:
+            self.time_steps = np.arange(starttime, endtime, self.stepsize)
+            self.value_steps = np.interp(self.time_steps, [self.last_time, time], [self.last_value, value])
+            result = np.c_[self.time_steps, self.value_steps]
+
+        else:
+            # same arithmetic as np.arange and np.interp, without temporary arrays
+            n = self.step_count(time)
+            if out is None:
+                out = np.empty((n, 1 + np.size(value)))
+            result = out[:n]
+            if n:
+                delta = (starttime + self.stepsize) - starttime
+                slope = (value - self.last_value) / float(time - self.last_time)
+                for i in range(n):
+                    t = starttime + i*delta
+                    result[i, 0] = t
+                    result[i, 1:] = slope*(t - self.last_time) + self.last_value
+            self.time_steps = result[:, 0]
+            self.value_steps = result[:, 1] if np.ndim(value) == 0 else result[:, 1:]
 
         self.last_time = time
-        self.last_value = value
+        # a copy, the caller may reuse its buffer for the next sample
+        self.last_value = np.array(value, dtype=float)
+
+        return result
+
+    def step_count(self, time):
+        """Number of points new_sample returns for a sample at time.
+        """
+        return max(0, int(np.ceil((time - self._starttime()) / float(self.stepsize))))
+
+    def _starttime(self):
+        return self.last_time + (self.stepsize - self.last_time)%self.stepsize
+
+    def process(self, times, values):
+        """Interpolate a sequence of samples at once, same as calling new_sample on each of
+        them and stacking the results.
+        """
+        times = np.asarray(times)
+        values = np.asarray(values, dtype=float)
+
+        # segment i goes from sample i-1 to sample i, the first one from the last sample seen
+        t0 = np.r_[self.last_time, times[:-1]]
+        v0 = np.concatenate([np.broadcast_to(self.last_value, values.shape[1:])[None], values[:-1]])
+
+        starttimes = t0 + (self.stepsize - t0)%self.stepsize
+        counts = np.ceil((times - starttimes) / float(self.stepsize)).clip(0).astype(int)
+
+        # index of the segment and of the step within the segment, for every output point
+        segment = np.repeat(np.arange(len(times)), counts)
+        step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        # same arithmetic as np.arange and np.interp, so that results match new_sample
+        delta = (starttimes + self.stepsize) - starttimes
+        self.time_steps = starttimes[segment] + step * delta[segment]
+        # broadcast the times against the channels, if any
+        dt = (times - t0).reshape((-1,) + (1,)*(values.ndim - 1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = (values - v0) / dt
+        elapsed = (self.time_steps - t0[segment]).reshape((-1,) + (1,)*(values.ndim - 1))
+        self.value_steps = slopes[segment] * elapsed + v0[segment]
+
+        if len(times):
+            self.last_time = times[-1]
+            self.last_value = np.array(values[-1], dtype=float)
 
         return np.c_[self.time_steps, self.value_steps]
 
@@ -94,8 +428,18 @@ class StepInterpolator(object):
 import warnings
 import scipy.signal
 class LowPassFilter(object):
-    """docstring for ClassName"""
-    def __init__(self, lowcut=15, sampling_frequency=50, order=5):
+    """Butterworth low-pass filter.
+
+    Args:
+        lowcut (float): cutoff frequency, in Hz.
+        sampling_frequency (float): sampling frequency, in Hz.
+        order (int): order of the filter.
+        channels (int): number of channels filtered together, None for scalar samples.
+        engine (str): 'ba' evaluates the transfer function polynomials directly (IIRFilter),
+            'sos' evaluates a cascade of second order sections (SOSFilter), which stays
+            stable at higher orders and low cutoff to sampling frequency ratios.
+    """
+    def __init__(self, lowcut=15, sampling_frequency=50, order=5, channels=None, engine='ba'):
         super(LowPassFilter, self).__init__()
 
         # low has to be in [0,1[
@@ -109,43 +453,57 @@ class LowPassFilter(object):
             lowcut = (0.5 * sampling_frequency) - 1e-3
             warnings.warn("LPF - setting lowcut to 1./sampling_rate instead of {}".format(lowcut))
 
-        def _butter_lowpass(lowcut, sampling_frequency, order=5):
+        def _butter_lowpass(lowcut, sampling_frequency, order=5, output='ba'):
             order = order
             fs = sampling_frequency
             nyq = 0.5 * fs
             low = lowcut / nyq
-            b, a = scipy.signal.butter(order, low, btype='low')
-            return b,a
+            return scipy.signal.butter(order, low, btype='low', output=output)
 
-        b,a = _butter_lowpass(lowcut, sampling_frequency, order)
-        self.iir = IIRFilter(b,a)
+        if engine == 'ba':
+            b,a = _butter_lowpass(lowcut, sampling_frequency, order)
+            self.iir = IIRFilter(b,a, channels)
+        elif engine == 'sos':
+            sos = _butter_lowpass(lowcut, sampling_frequency, order, output='sos')
+            self.iir = SOSFilter(sos, channels)
+        else:
+            raise ValueError("unknown engine {}, expected 'ba' or 'sos'".format(engine))
 
     def new_sample(self, x):
         return self.iir.new_sample(x)
 
+    def process(self, x):
+        return self.iir.process(x)
+
 
 class IIRFilter(object):
-    def __init__(self, B, A):
+    def __init__(self, B, A, channels=None):
         """Create an IIR filter, given the B and A coefficient vectors.
+
+        With channels, each sample is a vector of channels values, filtered independently.
         """
-        self.B = B
-        self.A = A
-        self.prev_outputs = RingBuffer(len(A)-1)
-        self.prev_inputs = RingBuffer(len(B))
+        self.B = np.ascontiguousarray(B, dtype=float)
+        self.A = np.ascontiguousarray(A, dtype=float)
+        self.channels = channels
+        self.prev_outputs = MirroredRingBuffer((len(A)-1, channels or 1))
+        self.prev_inputs = MirroredRingBuffer((len(B), channels or 1))
+
+        # final lfilter state of the last process call, None after filter
+        self._zf = None
 
     def filter(self, x):
         """Take one sample and filter it. Return the output.
         """
-        y = 0
+        self._zf = None
         self.prev_inputs.new_sample(x)
 
-        prev_inputs = self.prev_inputs.samples.reshape(-1)
-        prev_outputs = self.prev_outputs.samples.reshape(-1)
-
-        num = self.B * prev_inputs[::-1]
-        den = self.A[1:] * prev_outputs[::-1]
+        # one product over the window for all the channels
+        num = np.dot(self.B, self.prev_inputs.samples[::-1])
+        den = np.dot(self.A[1:], self.prev_outputs.samples[::-1])
 
-        y = (num.sum() - den.sum()) / self.A[0]
+        y = (num - den) / self.A[0]
+        if self.channels is None:
+            y = y[0]
         self.prev_outputs.new_sample(y)
 
         return y
@@ -153,6 +511,87 @@ class IIRFilter(object):
     def new_sample(self, x):
         return self.filter(x)
 
+    def process(self, x):
+        """Filter a block of samples in one pass, starting from the current state.
+
+        Consecutive blocks continue from the exact final state of lfilter, so that
+        filtering a signal block by block gives the same output as in one block.
+        """
+        x = np.asarray(x, dtype=float)
+        if not len(x):
+            return x.copy()
+
+        zi = self._block_state() if self._zf is None else self._zf
+        y, self._zf = scipy.signal.lfilter(self.B, self.A, x, axis=0, zi=zi)
+
+        self.prev_inputs.extend(x)
+        self.prev_outputs.extend(y)
+
+        return y
+
+    def _block_state(self):
+        """Convert the previous inputs and outputs into the delay values used by
+        scipy.signal.lfilter (transposed direct form II), see scipy.signal.lfiltic.
+        """
+        K = max(len(self.A), len(self.B)) - 1
+        B = np.r_[self.B, np.zeros(K + 1 - len(self.B))]
+        A = np.r_[self.A, np.zeros(K + 1 - len(self.A))]
+
+        # most recent sample first, one column per channel
+        padding = np.zeros((K, self.channels or 1))
+        x = np.concatenate([self.prev_inputs.samples[::-1], padding])
+        y = np.concatenate([self.prev_outputs.samples[::-1], padding])
+
+        zi = np.array([np.dot(B[k+1:], x[:K-k]) - np.dot(A[k+1:], y[:K-k]) for k in range(K)])
+        if self.channels is None:
+            zi = zi[:, 0]
+        return zi / self.A[0]
+
+
+class SOSFilter(object):
+    def __init__(self, sos, channels=None):
+        """Create an IIR filter as a cascade of second order sections, given the sos array
+        of shape (n_sections, 6), as returned by scipy.signal.butter(..., output='sos').
+
+        The state of the sections (transposed direct form II) is kept in zi, of shape
+        (n_sections, 2), or (n_sections, 2, channels), same as scipy.signal.sosfilt.
+        """
+        self.sos = np.asarray(sos, dtype=float)
+        assert np.all(self.sos[:, 3] == 1), "sos must be normalized, with a0 = 1"
+
+        self.channels = channels
+        if channels is None:
+            self.zi = np.zeros((len(self.sos), 2))
+        else:
+            self.zi = np.zeros((len(self.sos), 2, channels))
+
+        # the coefficients as python floats, faster to access in the per-sample loop
+        self._sections = [tuple(section) for section in self.sos.tolist()]
+
+    def filter(self, x):
+        """Take one sample and filter it. Return the output.
+        """
+        for z, (b0, b1, b2, _, a1, a2) in zip(self.zi, self._sections):
+            y = b0*x + z[0]
+            z[0] = b1*x - a1*y + z[1]
+            z[1] = b2*x - a2*y
+            x = y
+        return x
+
+    def new_sample(self, x):
+        return self.filter(x)
+
+    def process(self, x):
+        """Filter a block of samples in one pass, starting from the current state. The
+        result matches scipy.signal.sosfilt.
+        """
+        x = np.asarray(x, dtype=float)
+        if not len(x):
+            return x.copy()
+
+        y, self.zi[...] = scipy.signal.sosfilt(self.sos, x, axis=0, zi=self.zi)
+        return y
+
 
 class SavitskyGolayFitter(object):
     """Fit a polynome of order polyorder on a window of length window_length and returns
@@ -195,7 +634,7 @@ class SavitskyGolayFitter(object):
         ]]
 
     """
-    def __init__(self, window_length, polyorder, deriv=0, stepsize=None):
+    def __init__(self, window_length, polyorder, deriv=0, stepsize=None, channels=None):
         super(SavitskyGolayFitter, self).__init__()
 
         assert ((window_length % 2) != 0), "window_length must be odd"
@@ -207,8 +646,9 @@ class SavitskyGolayFitter(object):
         self.window_length = window_length
         self.polyorder = polyorder
         self.deriv = deriv
+        self.channels = channels
 
-        self.rb = RingBuffer(window_length)
+        self.rb = MirroredRingBuffer((window_length, channels or 1))
 
         # compute and store the convolution coefficients
         number_coeffs = polyorder + 1
@@ -218,7 +658,7 @@ class SavitskyGolayFitter(object):
             for k in range(-half_window, half_window+1)
             ])
         J_1 = np.linalg.pinv(J)
-        self.conv_coeffs = J_1[:deriv+1]
+        self.conv_coeffs = np.ascontiguousarray(J_1[:deriv+1])
 
         # # compute the derivative multiplying constants
         # if stepsize:
@@ -229,23 +669,73 @@ class SavitskyGolayFitter(object):
         # deriv_constant = np.ones(deriv+1)
         # self.deriv_constant = deriv_constant
 
-    def new_sample(self, x):
+    def new_sample(self, x, out=None):
         """Add a new sample to the ring buffer and returns the derivatives up to deriv order.
         Note that the derivatives are computed on a window which implements a time delay of
         window_length/2 samples.
+
+        If out is given, the derivatives are written into it. With channels, the derivatives
+        have shape (deriv+1, channels).
         """
         _ = self.rb.write(x)
-        derivs = np.dot(self.conv_coeffs, self.rb.samples.reshape(-1)) # * self.deriv_constant
+        window = self.rb.samples
+        if self.channels is None:
+            window = window.reshape(-1)
+        derivs = np.dot(self.conv_coeffs, window, out=out) # * self.deriv_constant
         return derivs[:self.deriv+1]
 
+    def process(self, x):
+        """Add a block of samples and returns the derivatives for each of them, as an
+        array of shape (len(x), deriv+1), or (len(x), deriv+1, channels). The derivatives
+        of a channel are the same, to the last bit, whatever the other channels.
+        """
+        x = np.asarray(x, dtype=float)
+        shape = (len(x), len(self.conv_coeffs))
+        if self.channels is not None:
+            shape += (self.channels,)
+        if not len(x):
+            return np.zeros(shape)
+
+        # the window before the first new sample, followed by the new samples
+        ext = np.concatenate([self.rb.samples[1:], x.reshape(len(x), -1)])
+
+        # one multiply-add per tap of the window, in the same order for every channel: a
+        # matrix product would sum in an order that depends on the number of channels, so
+        # that a channel filtered alone or with others would differ in the last bits
+        derivs = np.empty((len(x), len(self.conv_coeffs), ext.shape[1]))
+
+        # in blocks of rows that stay in the cache
+        block = max(1, 2**15 // ext.shape[1])
+        acc = np.empty((block, ext.shape[1]))
+        term = np.empty((block, ext.shape[1]))
+        coeffs = self.conv_coeffs.tolist()
+        for start in range(0, len(x), block):
+            n = min(block, len(x) - start)
+            for d, taps in enumerate(coeffs):
+                acc[:n] = 0
+                for j, c in enumerate(taps):
+                    np.multiply(ext[start + j:start + j + n], c, out=term[:n])
+                    acc[:n] += term[:n]
+                derivs[start:start + n, d] = acc[:n]
+
+        self.rb.extend(x)
+        return derivs.reshape(shape)
+
 
 
 class RingBuffer(object):
     """Implements a ring buffer of size (n,m).
 
     dtype can contain named columns.
+
+    With stats, the sum, sumsq, mean, var, std, min and max of each column over the n
+    samples of the window are updated with every write, and read in constant time: the
+    sums are compensated (Kahan), the mean and variance follow a sliding Welford update,
+    and min and max are kept in monotonic deques. The sums and moments are recomputed
+    from the window once every n writes, so that rounding errors do not build up. Without
+    stats, they are computed from the samples. The window starts filled with zeros.
     """
-    def __init__(self, size, init=0, columns=None):
+    def __init__(self, size, init=0, columns=None, stats=False):
 
         if type(size) == int:
             size = (size,1)
@@ -261,14 +751,70 @@ class RingBuffer(object):
 
         self.read_head = 1
         self.write_head = 0
-        self.sum = 0
+
+        self.stats = stats
+        if stats:
+            self._init_stats()
+
+    def _init_stats(self):
+        m = int(np.prod(self._samples.shape[1:]))
+
+        # sums and their compensations, the window holds zeros
+        self._sum = np.zeros(m)
+        self._sum_c = np.zeros(m)
+        self._sumsq = np.zeros(m)
+        self._sumsq_c = np.zeros(m)
+        self._mean = np.zeros(m)
+        self._m2 = np.zeros(m)
+
+        # (index, value) per column, values decreasing for max and increasing for min,
+        # the zeros of the window are represented by the newest one
+        self._count = self.n_samples
+        self._max = [collections.deque([(self.n_samples - 1, 0.)]) for j in range(m)]
+        self._min = [collections.deque([(self.n_samples - 1, 0.)]) for j in range(m)]
+
+    def _update_stats(self, old, x):
+        """Replace the sample old by x in the statistics of the window, after x was written.
+        """
+        old = np.asarray(old, dtype=float).ravel()
+        x = np.broadcast_to(np.asarray(x, dtype=float), self._samples.shape[1:]).ravel()
+
+        _kahan_add(self._sum, self._sum_c, x - old)
+        _kahan_add(self._sumsq, self._sumsq_c, x*x - old*old)
+
+        delta = x - old
+        mean = self._mean + delta / self.n_samples
+        self._m2 += delta * (x - mean + old - self._mean)
+        self._mean = mean
+
+        expired = self._count - self.n_samples
+        for j, v in enumerate(x.tolist()):
+            for d, keep in ((self._max[j], v.__lt__), (self._min[j], v.__gt__)):
+                while d and not keep(d[-1][1]):
+                    d.pop()
+                d.append((self._count, v))
+                if d[0][0] <= expired:
+                    d.popleft()
+        self._count += 1
+
+        if self._count % self.n_samples == 0:
+            self._resync_stats()
+
+    def _resync_stats(self):
+        window = self.samples.reshape(self.n_samples, -1)
+        self._sum = window.sum(axis=0)
+        self._sum_c = np.zeros_like(self._sum)
+        self._sumsq = (window**2).sum(axis=0)
+        self._sumsq_c = np.zeros_like(self._sumsq)
+        self._mean = window.mean(axis=0)
+        self._m2 = ((window - self._mean)**2).sum(axis=0)
 
     def write(self, x):
         self.new_sample(x)
     def new_sample(self, x):
-        """Write x at write position and return previous sample in place.
+        """Write x at write position and return previous sample.
         """
-        s = self._samples[self.write_head]
+        s = self._samples[self.write_head].copy()
         self._samples[self.write_head] = x
 
         self.read_head += 1
@@ -276,8 +822,30 @@ class RingBuffer(object):
         self.read_head %= self.n_samples
         self.write_head %= self.n_samples
 
+        if self.stats:
+            self._update_stats(s, x)
         return s
 
+    def extend(self, x):
+        """Write all the samples of x, in order.
+        """
+        x = np.asarray(x)[-self.n_samples:]
+        if self.stats:
+            for sample in x:
+                self.new_sample(sample)
+            return
+
+        index = (self.write_head + np.arange(len(x))) % self.n_samples
+        self._samples[index] = x.reshape((len(x),) + self._samples.shape[1:])
+
+        self._move_head(self.write_head + len(x))
+
+    def _move_head(self, write_head):
+        """Set the write position, the read position follows.
+        """
+        self.write_head = write_head % self.n_samples
+        self.read_head = (self.write_head + 1) % self.n_samples
+
     def __getitem__(self, value):
         # could implement slice
         return self._forward_index(value-1)
@@ -300,14 +868,142 @@ class RingBuffer(object):
     @property
     def samples(self):
         """Returns the samples as a numpy array."""
-        return np.vstack((self._samples[self.read_head-1:],self._samples[0:self.read_head-1]))
+        return np.concatenate((self._samples[self.read_head-1:],self._samples[0:self.read_head-1]))
 
     @property
     def samples_df(self):
         """Returns the samples as a pandas dataframes with named columns."""
-        return pd.DataFrame(np.vstack((self._samples[self.read_head-1:],self._samples[0:self.read_head-1])), columns=self.columns)
+        return pd.DataFrame(np.concatenate((self._samples[self.read_head-1:],self._samples[0:self.read_head-1])), columns=self.columns)
 
     @property
     def size(self):
         return self.n_samples
 
+    def _stat(self, value):
+        return value.reshape(self._samples.shape[1:])
+
+    @property
+    def sum(self):
+        if not self.stats:
+            return self.samples.sum(axis=0)
+        return self._stat(self._sum - self._sum_c)
+
+    @property
+    def sumsq(self):
+        if not self.stats:
+            return (self.samples**2).sum(axis=0)
+        return self._stat(self._sumsq - self._sumsq_c)
+
+    @property
+    def mean(self):
+        if not self.stats:
+            return self.samples.mean(axis=0)
+        return self._stat(self._mean.copy())
+
+    @property
+    def var(self):
+        """Variance of the window, ddof=0."""
+        if not self.stats:
+            return self.samples.var(axis=0)
+        return self._stat(np.maximum(self._m2, 0) / self.n_samples)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+    @property
+    def max(self):
+        if not self.stats:
+            return self.samples.max(axis=0)
+        return self._stat(np.array([d[0][1] for d in self._max]))
+
+    @property
+    def min(self):
+        if not self.stats:
+            return self.samples.min(axis=0)
+        return self._stat(np.array([d[0][1] for d in self._min]))
+
+
+def _kahan_add(total, compensation, x):
+    """total += x in place, with Kahan compensated summation.
+    """
+    y = x - compensation
+    t = total + y
+    compensation[:] = (t - total) - y
+    total[:] = t
+
+
+class MirroredRingBuffer(RingBuffer):
+    """Ring buffer of size (n,m) whose samples are stored twice, back to back, so that the
+    ordered window is always a contiguous slice of the storage.
+
+    samples returns a read-only view instead of a copy, it is only valid until the next write.
+    """
+    def __init__(self, size, init=0, columns=None, stats=False):
+        super(MirroredRingBuffer, self).__init__(size, init, columns, stats)
+
+        self._samples = np.zeros((2*self.n_samples,) + self._samples.shape[1:])
+
+        self._window = self._samples.view()
+        self._window.flags.writeable = False
+
+    def new_sample(self, x):
+        """Write x at write position and return previous sample.
+        """
+        s = self._samples[self.write_head].copy()
+        self._samples[self.write_head] = x
+        self._samples[self.write_head + self.n_samples] = x
+
+        self.read_head += 1
+        self.write_head += 1
+        self.read_head %= self.n_samples
+        self.write_head %= self.n_samples
+
+        if self.stats:
+            self._update_stats(s, x)
+        return s
+
+    def extend(self, x):
+        """Write all the samples of x, in order.
+        """
+        x = np.asarray(x)[-self.n_samples:]
+        x = x.reshape((len(x),) + self._samples.shape[1:])
+
+        if self.stats:
+            for sample in x:
+                self.new_sample(sample)
+            return
+
+        index = (self.write_head + np.arange(len(x))) % self.n_samples
+        self._samples[index] = x
+        self._samples[index + self.n_samples] = x
+
+        self._move_head(self.write_head + len(x))
+
+    @property
+    def samples(self):
+        """Returns the samples as a read-only view, oldest first."""
+        return self._window[self.write_head:self.write_head + self.n_samples]
+
+    @property
+    def samples_df(self):
+        """Returns the samples as a pandas dataframes with named columns."""
+        return pd.DataFrame(self.samples, columns=self.columns)
+
+
+def benchmark_ringbuffer(sizes=(5, 16, 64, 256, 1024, 4096), number=10000):
+    """Print the time taken by a write followed by a read of the window, in microseconds,
+    for RingBuffer and MirroredRingBuffer.
+    """
+    print("{:>6} {:>12} {:>12}".format("size", "RingBuffer", "Mirrored"))
+
+    for size in sizes:
+        timings = []
+        for cls in (RingBuffer, MirroredRingBuffer):
+            rb = cls(size)
+            def step():
+                rb.new_sample(1.)
+                return rb.samples
+            timings.append(min(timeit.repeat(step, number=number, repeat=3)) / number * 1e6)
+
+        print("{:>6} {:>12.2f} {:>12.2f}".format(size, *timings))
@@ -1,8 +1,20 @@
+import atexit
 import logging
+import logging.handlers
+import threading
+import time
+from six.moves import queue
+
 logger = logging.getLogger()
 logging_level = logging.DEBUG
 
-def setup_logging(logger, filename):
+def setup_logging(logger, filename, queue_size=None):
+    """Log to stderr, synchronously, or with queue_size from a QueueListener thread, so
+    that logging never blocks the caller: the records are put in a queue of queue_size
+    records, dropped when it is full, and written by the thread.
+
+    Returns the handler added to logger, a DroppingQueueHandler with queue_size.
+    """
     LOG_FORMAT = "[%(module)-15s:%(lineno)5d] %(levelname)5s %(asctime)-5s %(message)s"
     DATE_FORMAT = "%Y-%m-%d %H:%M:%S:%m"
     formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
@@ -10,9 +22,120 @@ def setup_logging(logger, filename):
     handler = logging.StreamHandler()
     handler.setLevel(logging_level)
     handler.setFormatter(formatter)
+
+    if queue_size is not None:
+        handler = DroppingQueueHandler(queue_size, handler)
+        atexit.register(handler.stop)
     logger.addHandler(handler)
 
     logger.setLevel(logging_level)
+    return handler
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Puts the records in a bounded queue, written to handlers by a QueueListener thread.
+
+    The records are dropped when the queue is full, and counted in dropped. They are
+    formatted by the listener, so the arguments of a record should not be modified after
+    logging it.
+    """
+    def __init__(self, queue_size, *handlers):
+        super(DroppingQueueHandler, self).__init__(queue.Queue(queue_size))
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers,
+            respect_handler_level=True)
+        self.listener.start()
+        self._running = True
+
+    def prepare(self, record):
+        # the message is formatted in the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def stop(self):
+        """Write the records left in the queue and stop the thread, the number of dropped
+        records is logged last.
+        """
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        self.listener.stop()
+
+        if self.dropped:
+            record = logging.makeLogRecord({'name': __name__, 'levelno': logging.WARNING,
+                'levelname': 'WARNING', 'msg': "dropped %d log records", 'args': (self.dropped,)})
+            self.listener.handle(record)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most rate records per second through, in bursts of up to burst records,
+    and counts the others in suppressed.
+    """
+    def __init__(self, rate, burst=None):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst or max(1, rate)
+        self.suppressed = 0
+
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.suppressed += 1
+            return False
+
+
+class SampleFilter(logging.Filter):
+    """Lets one record in every `every` through, and counts the others in suppressed.
+    """
+    def __init__(self, every):
+        super(SampleFilter, self).__init__()
+        self.every = every
+        self.suppressed = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            self._count += 1
+            if (self._count - 1) % self.every == 0:
+                return True
+            self.suppressed += 1
+            return False
+
+
+def message_logger(name, rate=None, burst=None, every=None):
+    """Returns the logger of the per-message logs of module name, e.g. 'zmq' or 'proxy',
+    limited to rate records per second and/or sampled one in every `every`. The limits
+    replace those of a previous call.
+    """
+    message_log = logging.getLogger(name + '.messages')
+    for f in list(message_log.filters):
+        if isinstance(f, (SampleFilter, RateLimitFilter)):
+            message_log.removeFilter(f)
+    if every is not None:
+        message_log.addFilter(SampleFilter(every))
+    if rate is not None:
+        message_log.addFilter(RateLimitFilter(rate, burst))
+    return message_log
 
 
 import datetime
@@ -1,22 +1,31 @@
-
 import numpy as np
 
-import scipy
+import analysis
+
+
 def plot_fft(signal, sampling_period, ax):
-    # Number of samplepoints
-    N = signal.shape[0]
-    # sample spacing
-    T = sampling_period
+    frequencies, amplitudes = analysis.amplitude_spectrum(signal, sampling_period)
+    plot_spectrum(frequencies, amplitudes, ax)
+
+
+def plot_spectrum(frequencies, values, ax, **kwargs):
+    """Draw a spectrum computed with analysis, e.g. amplitude_spectrum or StreamingSpectrum.psd.
+    """
+    ax.plot(frequencies, values, **kwargs)
+
 
-    x = np.linspace(0.0, N*T, N)
-    y = signal
+def plot_spectrogram(times, frequencies, spectra, ax, **kwargs):
+    """Draw the spectra of StreamingSpectrum.update, of shape (len(times), len(frequencies)),
+    in decibels.
+    """
+    return ax.pcolormesh(times, frequencies, 10 * np.log10(np.asarray(spectra).T), shading='auto', **kwargs)
 
-    yf = scipy.fftpack.fft(y)
-    xf = np.linspace(0.0, 1.0/(2.0*T), N/2)
 
-    ax.plot(xf, 2.0/N * np.abs(yf[:N//2]))
+def plot_autocorr(correlation, ax, sampling_period=1, **kwargs):
+    """Draw the autocorrelation of analysis.autocorr against the lag.
+    """
+    ax.plot(np.arange(len(correlation)) * sampling_period, correlation, **kwargs)
 
 
-def autocorr(x):
-    result = np.correlate(x, x, mode='full')
-    return result[int(result.size/2):] / result[int(result.size/2)]
\ No newline at end of file
+# see analysis.autocorr, in O(n log n)
+autocorr = analysis.autocorr
@@ -1,5 +1,19 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import EllipseCollection
 from matplotlib.patches import Ellipse
 
+import functional
+
+
+def eigsorted(cov):
+    """Eigenvalues and eigenvectors of cov, largest eigenvalue first.
+    """
+    vals, vecs = np.linalg.eigh(cov)
+    order = vals.argsort()[::-1]
+    return vals[order], vecs[:,order]
+
+
 def plot_point_cov(points, nstd=2, ax=None, **kwargs):
     """
     Plots an `nstd` sigma ellipse based on the mean and covariance of a point
@@ -43,11 +57,6 @@ def plot_cov_ellipse(cov, pos, nstd=2, ax=None, **kwargs):
     -------
         A matplotlib ellipse artist
     """
-    def eigsorted(cov):
-        vals, vecs = np.linalg.eigh(cov)
-        order = vals.argsort()[::-1]
-        return vals[order], vecs[:,order]
-
     if ax is None:
         ax = plt.gca()
 
@@ -66,15 +75,238 @@ def compute_ellipse_parameters(points):
     pos = points.mean(axis=0)
     cov = np.cov(points, rowvar=False)
 
-    def eigsorted(cov):
-        vals, vecs = np.linalg.eigh(cov)
-        order = vals.argsort()[::-1]
-        return vals[order], vecs[:,order]
-
     vals, vecs = eigsorted(cov)
     theta = np.degrees(np.arctan2(*vecs[:,0][::-1]))
 
     # Width and height are "full" widths, not radius
     width, height = 2 * 2 * np.sqrt(vals)
 
-    return pos, width, height
\ No newline at end of file
+    return pos, width, height
+
+
+def cov_ellipse_parameters(cov, nstd=2):
+    """
+    Ellipses of a stack of 2x2 covariance matrices, with the closed form of the
+    eigenvalues of a symmetric 2x2 matrix.
+
+    Parameters
+    ----------
+        cov : A Kx2x2 array of covariance matrices.
+        nstd : The radius of the ellipses in numbers of standard deviations.
+
+    Returns
+    -------
+        width, height : The full widths of the ellipses, along their major and
+            minor axes, arrays of K values.
+        angle : The angle of the major axes in degrees, in ]-90, 90].
+    """
+    cov = np.asarray(cov, dtype=float)
+    a, b, c = cov[..., 0, 0], cov[..., 0, 1], cov[..., 1, 1]
+
+    half_trace = (a + c) / 2
+    radius = np.hypot((a - c) / 2, b)
+    major = half_trace + radius
+    minor = np.maximum(half_trace - radius, 0)
+
+    angle = np.degrees(np.arctan2(2 * b, a - c) / 2)
+
+    # Width and height are "full" widths, not radius
+    return 2 * nstd * np.sqrt(major), 2 * nstd * np.sqrt(minor), angle
+
+
+def batch_ellipse_parameters(points, labels=None, nstd=2):
+    """
+    Mean and covariance ellipses of many point clouds at once.
+
+    Parameters
+    ----------
+        points : An Nx2 array of the points of all the clouds, with labels, or
+            a KxNx2 array of K clouds of N points.
+        labels : The cloud of each point, an array of N labels. Ellipse k is
+            the one of the label np.unique(labels)[k].
+        nstd : The radius of the ellipses in numbers of standard deviations.
+
+    Returns
+    -------
+        pos : A Kx2 array of the centers of the ellipses.
+        width, height, angle : see cov_ellipse_parameters. The ellipses of
+            clouds of less than 2 points are nan.
+    """
+    points = np.asarray(points, dtype=float)
+
+    if labels is None:
+        pos = points.mean(axis=1)
+        d = points - pos[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = np.einsum('kni,knj->kij', d, d) / (points.shape[1] - 1)
+    else:
+        groups, index = np.unique(labels, return_inverse=True)
+        index = index.ravel()
+        k = len(groups)
+        counts = np.bincount(index, minlength=k).astype(float)
+
+        pos = np.stack([np.bincount(index, points[:, i], k) for i in range(2)],
+            axis=1)
+        pos /= counts[:, None]
+
+        # centered on the mean of each cloud
+        d = points - pos[index]
+        cov = np.empty((k, 2, 2))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, j in ((0, 0), (1, 1), (0, 1)):
+                cov[:, i, j] = np.bincount(index, d[:, i] * d[:, j], k) / (counts - 1)
+            cov[:, 1, 0] = cov[:, 0, 1]
+
+    with np.errstate(invalid='ignore'):
+        width, height, angle = cov_ellipse_parameters(cov, nstd)
+    return pos, width, height, angle
+
+
+def plot_ellipses(pos, width, height, angle, ax=None, **kwargs):
+    """
+    Plots many ellipses, e.g. from batch_ellipse_parameters, as a single
+    artist.
+
+    Parameters
+    ----------
+        pos : A Kx2 array of the centers of the ellipses.
+        width, height : The full widths of the ellipses, in data units.
+        angle : The angles of the ellipses, in degrees.
+        ax : The axis that the ellipses will be plotted on. Defaults to the
+            current axis.
+        Additional keyword arguments are passed on to the EllipseCollection.
+
+    Returns
+    -------
+        A matplotlib EllipseCollection
+    """
+    if ax is None:
+        ax = plt.gca()
+
+    ellipses = EllipseCollection(width, height, angle, units='xy', offsets=pos,
+        offset_transform=ax.transData, **kwargs)
+
+    ax.add_collection(ellipses)
+    ax.update_datalim(pos)
+    ax.autoscale_view()
+    return ellipses
+
+
+class EllipseTracker(object):
+    """
+    Covariance ellipse of a stream of 2-d points, updated in O(1) per point with
+    Welford's algorithm instead of recomputing the mean and covariance of all
+    the points.
+
+    The ellipse is that of all the points so far, of the last `window` points
+    (kept in a functional.RingBuffer), or, with `forgetting`, of all the points
+    with weights decaying by that factor per point.
+
+    Parameters
+    ----------
+        window : The number of points in the sliding window, at least 2.
+        forgetting : The exponential forgetting factor, in ]0, 1], e.g. 0.99
+            for an effective memory of about 100 points.
+        nstd : The radius of the ellipse in numbers of standard deviations.
+    """
+    def __init__(self, window=None, forgetting=None, nstd=2):
+        super(EllipseTracker, self).__init__()
+
+        if window is not None and forgetting is not None:
+            raise ValueError("window and forgetting are exclusive")
+        if window is not None and window < 2:
+            raise ValueError("window must be at least 2, got {}".format(window))
+        if forgetting is not None and not 0 < forgetting <= 1:
+            raise ValueError("forgetting must be in ]0, 1], got {}".format(forgetting))
+
+        self.window = window
+        self.forgetting = forgetting
+        self.nstd = nstd
+
+        self.buffer = functional.RingBuffer((window, 2)) if window is not None else None
+        self.reset()
+
+    def reset(self):
+        """Forget all the points.
+        """
+        self.n = 0
+        self._weight = 0.
+        self._mean = np.zeros(2)
+        # sum of the outer products of the deviations from the mean
+        self._comoment = np.zeros((2, 2))
+
+    def update(self, point):
+        """Add a point, a sequence of [x, y].
+        """
+        x = np.asarray(point, dtype=float).reshape(2)
+
+        if self.buffer is not None:
+            old = self.buffer.new_sample(x)
+            if self.n >= self.window:
+                self._remove(old)
+
+        if self.forgetting is not None:
+            self._comoment *= self.forgetting
+            self._weight = self._weight * self.forgetting + 1
+        else:
+            self._weight += 1
+
+        delta = x - self._mean
+        self._mean += delta / self._weight
+        self._comoment += np.outer(delta, x - self._mean)
+        self.n += 1
+
+        # recomputed once per window, so that rounding errors do not build up
+        if self.buffer is not None and self.n % self.window == 0:
+            self._resync()
+
+    def extend(self, points):
+        """Add the points of an Nx2 array, in order.
+        """
+        for point in np.asarray(points, dtype=float).reshape(-1, 2):
+            self.update(point)
+
+    def _remove(self, x):
+        self._weight -= 1
+        delta = x - self._mean
+        self._mean -= delta / self._weight
+        self._comoment -= np.outer(delta, x - self._mean)
+
+    def _resync(self):
+        points = self.buffer.samples
+        self._mean = points.mean(axis=0)
+        d = points - self._mean
+        self._comoment = d.T.dot(d)
+
+    @property
+    def mean(self):
+        """The center of the ellipse, nan before the first point.
+        """
+        if not self.n:
+            return np.full(2, np.nan)
+        return self._mean.copy()
+
+    @property
+    def cov(self):
+        """The covariance of the points, ddof=1 as np.cov, or the weighted
+        covariance with forgetting. nan before the second point.
+        """
+        if self.n < 2:
+            return np.full((2, 2), np.nan)
+        if self.forgetting is not None:
+            return self._comoment / self._weight
+        return self._comoment / (self._weight - 1)
+
+    def parameters(self):
+        """
+        Returns
+        -------
+            pos, width, height, angle : see batch_ellipse_parameters.
+        """
+        width, height, angle = cov_ellipse_parameters(self.cov, self.nstd)
+        return self.mean, float(width), float(height), float(angle)
+
+    def plot(self, ax=None, **kwargs):
+        """Plots the current ellipse, see plot_cov_ellipse.
+        """
+        return plot_cov_ellipse(self.cov, self.mean, self.nstd, ax, **kwargs)
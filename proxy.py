@@ -1,22 +1,103 @@
 import sys
 import traceback
 import collections
+import concurrent.futures
+import contextlib
+import functools
+import inspect
 import logging
 import threading
+import time
 
 import zmq
 
 import six
 from six.moves import queue
+from six.moves import cPickle as pickle
+
+import serialization
+
+logger = logging.getLogger(__name__)
+# per-message logs, see logging.message_logger to rate limit them
+message_logger = logging.getLogger(__name__ + '.messages')
+
+# command of a request running a list of (attr, args, kwargs) in order
+CALL_MANY = '__call_many__'
+# command of a request setting an attribute, args are (attr, value)
+SETATTR = '__setattr__'
+
+# topic of the invalidation events, followed by the object and attribute names, the
+# attribute '*' invalidates every attribute of the object
+INVALIDATE = b'invalidate'
+
+# name sent by the clients before objects were named, served by the first object
+LEGACY_NAME = '(self.obj)'
+
+
+class _NoLock(object):
+    def __enter__(self):
+        pass
+    def __exit__(self, *exc_info):
+        pass
+
+
+class _Served(object):
+    """An object registered in a ProxyServer, with its bound methods and property getters
+    looked up once. Instance attributes are not in the tables and are read with getattr.
+    """
+    def __init__(self, obj, name, thread_safe, readonly):
+        self.obj = obj
+        self.name = name
+        self.lock = _NoLock() if thread_safe else threading.Lock()
+        self.readonly = frozenset(readonly)
+
+        self.methods = {}
+        self.getters = {}
+        instance_attrs = getattr(obj, '__dict__', {})
+        for name in dir(type(obj)):
+            if name.startswith('__') or name in instance_attrs:
+                continue
+            # not getattr, that would evaluate the properties
+            static = inspect.getattr_static(obj, name)
+            if isinstance(static, property):
+                if static.fget is not None:
+                    self.getters[name] = functools.partial(static.fget, obj)
+            elif inspect.isroutine(static) or isinstance(static, (staticmethod, classmethod)):
+                self.methods[name] = getattr(obj, name)
 
 
 class ProxyServer(threading.Thread):
-    """Proxy manager to one object."""
-    def __init__(self, port=8123):
+    """Proxy manager to named objects.
+
+    Clients address the objects by the name they were added with, an unknown name is
+    replied with a KeyError, and the LEGACY_NAME of older clients goes to the first
+    object. With workers, the server is a broker: a ROUTER socket receives the requests
+    of all the clients and hands them over inproc to a pool of worker threads, so that a
+    slow call does not block the other clients. Calls to an object run one at a time,
+    unless it was added with thread_safe=True.
+
+    With a pub_port, the server publishes invalidation events for the clients caching
+    attributes: the name of an attribute set with ProxyClient.remote_setattr, or '*' after
+    each call to a method that was not declared readonly.
+
+    Replies use the serializer of the request, or pickle when it cannot encode them, e.g.
+    exceptions with msgpack. With pickle5, the arrays of a reply are copied, the object
+    can modify them while the reply is sent.
+    """
+    def __init__(self, port=8123, workers=0, pub_port=None):
         super(ProxyServer, self).__init__()
 
         self.obj = []
         self.port = port
+        self.workers = workers
+        self.pub_port = pub_port
+
+        # the _Served objects by name, in the order they were added
+        self._registry = collections.OrderedDict()
+
+        # workers publish from their own thread
+        self.pub = None
+        self._pub_lock = threading.Lock()
 
         self.is_looping = threading.Event()
         self.start()
@@ -27,6 +108,21 @@ class ProxyServer(threading.Thread):
 
         self.context = zmq.Context()
 
+        if self.pub_port is not None:
+            self.pub = self.context.socket(zmq.PUB)
+            self.pub.setsockopt(zmq.LINGER, 0)
+            self.pub.bind("tcp://*:%s" % self.pub_port)
+
+        if self.workers:
+            self._run_broker()
+        else:
+            self._run_rep()
+
+        if self.pub is not None:
+            self.pub.close()
+
+    def _run_rep(self):
+
         self.rep = self.context.socket(zmq.REP)
         self.rep.bind("tcp://*:%s" % self.port)
 
@@ -44,88 +140,401 @@ class ProxyServer(threading.Thread):
             socks = dict(self.poll.poll(500))  # 500 ms for timeout
 
             if socks.get(self.rep) == zmq.POLLIN:
-                obj_class, cmd, args, kwargs = self.rep.recv_pyobj()
+                self._handle(self.rep)
 
-                print(obj_class, cmd, args, kwargs)
+        self.rep.close()
 
-                try:
+    def _run_broker(self):
+        """Forward requests from the clients to the workers, and replies back.
+        """
+        frontend = self.context.socket(zmq.ROUTER)
+        frontend.bind("tcp://*:%s" % self.port)
 
-                    # find obj: need more thoughts
-                    # obj = [o for o in self.obj if isinstance(self.obj, obj_class)][0]
-                    obj = self.obj[0]
+        self.backend_endpoint = "inproc://proxy-workers-{}".format(id(self))
+        backend = self.context.socket(zmq.DEALER)
+        backend.bind(self.backend_endpoint)
 
-                    fn = getattr(obj,cmd)
-                    if isinstance(fn, collections.Callable):
-                        retval = fn(*args, **kwargs)
-                    else:
-                        retval = fn
+        workers = [threading.Thread(target=self._work) for i in range(self.workers)]
+        for worker in workers:
+            worker.start()
+
+        poll = zmq.Poller()
+        poll.register(frontend, zmq.POLLIN)
+        poll.register(backend, zmq.POLLIN)
+
+        while self.is_looping.is_set():
+            socks = dict(poll.poll(500))  # 500 ms for timeout
+
+            for src, dst in ((frontend, backend), (backend, frontend)):
+                while socks.get(src) == zmq.POLLIN and src.poll(0):
+                    dst.send_multipart(src.recv_multipart())
 
-                    self.rep.send_pyobj((True, retval), protocol=-1)
+        for worker in workers:
+            worker.join()
+        frontend.close()
+        backend.close()
 
-                except:
-                    # exception, return the full exception info
-                    info = sys.exc_info()
-                    tb = "\n".join(traceback.format_exception(*info, limit=20))
-                    self.rep.send_pyobj((False, (info[1], tb)), protocol=-1)
+    def _work(self):
+        rep = self.context.socket(zmq.REP)
+        rep.connect(self.backend_endpoint)
+
+        while self.is_looping.is_set():
+            if rep.poll(500):
+                self._handle(rep)
+
+        rep.close()
+
+    def _handle(self, rep):
+        """Receive one request on the REP socket, run it and send the result.
+        """
+        frames = rep.recv_multipart(copy=False)
+        if len(frames) == 1:
+            # a single pickle frame, from send_pyobj
+            serializer = None
+            name, cmd, args, kwargs = pickle.loads(frames[0].bytes)
+        else:
+            serializer = serialization.serializer_of(frames)
+            name, cmd, args, kwargs = serialization.loads(frames)
+
+        message_logger.debug("%s %s %s %s", name, cmd, args, kwargs)
+
+        try:
+
+            served = self._registry.get(name)
+            if served is None and name == LEGACY_NAME and self._registry:
+                served = next(iter(self._registry.values()))
+            if served is None:
+                raise KeyError("no object is served as {}".format(name))
+
+            with served.lock:
+                if cmd == CALL_MANY:
+                    # one (success, value) per call, in order
+                    retval = [self._try_call(served, *call) for call in args]
+                else:
+                    retval = self._call(served, cmd, args, kwargs)
+
+            self._reply(rep, serializer, (True, retval))
+
+        except:
+            # exception, return the full exception info
+            self._reply(rep, serializer, (False, _exception_info()))
+
+    def _reply(self, rep, serializer, reply):
+        if serializer is None:
+            rep.send_pyobj(reply, protocol=-1)
+            return
+
+        try:
+            frames = serialization.dumps(reply, serializer)
+        except Exception:
+            frames = serialization.dumps(reply, serialization.FALLBACK)
+        rep.send_multipart(frames, copy=False)
+
+    def _call(self, served, cmd, args, kwargs):
+        if cmd == SETATTR:
+            setattr(served.obj, *args)
+            self._publish(served, args[0])
+            return None
+
+        getter = served.getters.get(cmd)
+        if getter is not None:
+            return getter()
+
+        fn = served.methods.get(cmd)
+        if fn is None:
+            fn = getattr(served.obj, cmd)
+            if not callable(fn):
+                return fn
+
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # still published when the call failed half way
+            if cmd not in served.readonly:
+                self._publish(served, '*')
+
+    def _publish(self, served, attr):
+        """Tell the clients that the cached value of attr of served is stale.
+        """
+        if self.pub is None:
+            return
+        with self._pub_lock:
+            self.pub.send_multipart([INVALIDATE, served.name.encode('utf-8'), attr.encode('utf-8')])
+
+    def _try_call(self, served, cmd, args=(), kwargs={}):
+        try:
+            return (True, self._call(served, cmd, args, kwargs))
+        except:
+            return (False, _exception_info())
 
 
     def close(self):
         self.is_looping.clear()
         self.join()  # wait for thread to finish
-        self.rep.close()
         self.context.term()
 
 
-    def add(self, obj):
+    def add(self, obj, thread_safe=False, readonly=(), name=None):
+        """Serve obj under name, the name of its class by default. With workers, its
+        methods are called from several threads at once if thread_safe, one at a time
+        otherwise. Calls to the methods named in readonly do not invalidate the attributes
+        cached by the clients.
+        """
+        if name is None:
+            name = type(obj).__name__
+        if name in self._registry:
+            raise ValueError("an object is already served as %s" % name)
+
+        self._registry[name] = _Served(obj, name, thread_safe, readonly)
         self.obj.append(obj)
 
 
+def _exception_info():
+    """Returns the current exception and its formatted traceback.
+    """
+    info = sys.exc_info()
+    tb = "\n".join(traceback.format_exception(*info, limit=20))
+    return (info[1], tb)
+
+
 class ProxyClient(object):
     """Proxy for an ExperimentLog object.
     Redirects calls and property accesses to the real, remote logging object
+
+    Within a batch() block, calls and property reads return futures instead, and are
+    all sent in one message at the end of the block:
+
+        with client.batch():
+            a = client.session_id
+            client.log(1)
+        print(a.result())
+
+    The attributes in cache, a dict of {attr: ttl} with ttl in seconds or None, or a list
+    of attrs, are read once and then served locally until they expire, are evicted by the
+    cache_size most recently used ones, or are invalidated by the server publishing on
+    invalidation_port. Invalidations reach the client asynchronously: a read right after
+    another client changed the value may still return the old one.
+
+    The methods of the client, call_many, batch, invalidate, remote_setattr and
+    disconnect, and its attributes obj, port, context and socket hide the remote
+    attributes of the same names.
+
+    The remote object is the one served under name, the name of the class of obj by
+    default. Requests are sent with serializer, see serialization, the default one if None.
     """
-    def __init__(self, obj, port=8123):
+    def __init__(self, obj, port=8123, cache=None, cache_size=128, invalidation_port=None,
+                 name=None, serializer=None):
 
         # possibly init obj
         # super(type(obj), self).__init__()
 
         self.obj = obj
         self.port = port
+        # not public, it would hide the attribute name of the remote object
+        self._name = type(obj).__name__ if name is None else name
+        self._serializer = serialization.get_serializer(serializer)
+
+        # whether each attribute of obj is a method, and the calls of the current batch
+        self._callables = {}
+        self._batch = None
+
+        # ttl of the cached attributes, and their (value, expiry) by least recent use
+        if cache is not None and not isinstance(cache, dict):
+            cache = dict.fromkeys(cache)
+        self._cache_ttl = cache or {}
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache_size
 
         # connect to the server
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.REQ)
         self.socket.connect("tcp://localhost:%s" % self.port)
 
+        self._sub = None
+        if invalidation_port is not None:
+            self._sub = self.context.socket(zmq.SUB)
+            self._sub.setsockopt(zmq.SUBSCRIBE, INVALIDATE)
+            self._sub.connect("tcp://localhost:%s" % invalidation_port)
 
-    def __getattr__(self, attr):
 
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
 
         # redirect properties
-        if not isinstance(getattr(self.obj, attr) , collections.Callable):
+        if not self._is_callable(attr):
         # attr in ['data', 'session_path', 'session_id', 't', 'in_run', 'random_seed']:
-            self.socket.send_pyobj(('(self.obj)', attr,(),()))
-            success, value = self.socket.recv_pyobj()
-            if success:
-                return value
-            else:
-                # deal with exceptions in the remote process
-                logging.error(value[1])
-                raise value[0]
+            if attr in self._cache_ttl and self._batch is None:
+                return self._cached(attr)
+            return self._remote(attr, (), {})
 
         # redirect calls to the remote object
         else:
             def proxy(*args, **kwargs):
-                self.socket.send_pyobj(('(self.obj)', attr, args, kwargs), protocol=-1)
-                success, value = self.socket.recv_pyobj()
-                if success:
-                    return value
-                else:
-                    # deal with exceptions in the remote process
-                    logger.error(value[1])
-                    raise value[0]
+                return self._remote(attr, args, kwargs)
 
             return proxy
 
+    def _is_callable(self, attr):
+        """Whether attr is a method, from the class of obj so that properties are not
+        evaluated locally, or else from obj, for callables set as instance attributes.
+        """
+        if attr not in self._callables:
+            value = getattr(type(self.obj), attr, None)
+            if value is None:
+                value = getattr(self.obj, attr, None)
+            self._callables[attr] = callable(value)
+        return self._callables[attr]
+
+    def _cached(self, attr):
+        """Read attr from the cache, or from the server when missing or stale.
+        """
+        self._drain_invalidations()
+
+        entry = self._cache.pop(attr, None)
+        if entry is None or (entry[1] is not None and entry[1] < time.time()):
+            value = self._request(attr, (), {})
+            ttl = self._cache_ttl[attr]
+            entry = (value, None if ttl is None else time.time() + ttl)
+
+        # most recently used last, evict from the front
+        self._cache[attr] = entry
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+        return entry[0]
+
+    def _drain_invalidations(self):
+        while self._sub is not None and self._sub.poll(0):
+            topic, name, attr = self._sub.recv_multipart()
+            if name.decode('utf-8') != self._name:
+                continue
+            attr = attr.decode('utf-8')
+            if attr == '*':
+                self._cache.clear()
+            else:
+                self._cache.pop(attr, None)
+
+    def invalidate(self, attr=None):
+        """Drop attr, or every attribute, from the cache.
+        """
+        if attr is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(attr, None)
+
+    def remote_setattr(self, attr, value):
+        """Set attr on the remote object, invalidating it in the cache of all clients.
+        """
+        self._cache.pop(attr, None)
+        return self._remote(SETATTR, (attr, value), {})
+
+    def _remote(self, attr, args, kwargs):
+        """Run attr on the remote object, or queue it in the current batch.
+        """
+        if self._batch is not None:
+            future = concurrent.futures.Future()
+            self._batch.append((future, (attr, args, kwargs)))
+            return future
+
+        return self._request(attr, args, kwargs)
+
+    def _request(self, cmd, args, kwargs):
+        # the reply is waited for, the request is sent by then
+        request = serialization.dumps((self._name, cmd, args, kwargs), self._serializer,
+            copy=False)
+        self.socket.send_multipart(request, copy=False)
+        success, value = serialization.loads(self.socket.recv_multipart(copy=False))
+        if success:
+            return value
+        else:
+            # deal with exceptions in the remote process
+            logger.error("%s", value[1])
+            raise value[0]
+
+    def call_many(self, calls):
+        """Run a list of (attr, args, kwargs) on the remote object, in order and in one
+        round trip. Returns the list of results, properties are read with no args.
+        Raises the exception of the first call that failed, after all of them ran.
+        """
+        results = self._request(CALL_MANY, [tuple(call) for call in calls], {})
+
+        for success, value in results:
+            if not success:
+                logger.error("%s", value[1])
+                raise value[0]
+        return [value for success, value in results]
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Within the block, calls and property reads return futures, resolved at the end
+        of the block with one round trip.
+        """
+        self._batch = []
+        try:
+            yield self
+        except:
+            for future, call in self._batch:
+                future.cancel()
+            raise
+        else:
+            batch = self._batch
+            self._batch = None
+            if batch:
+                results = self._request(CALL_MANY, [call for future, call in batch], {})
+                for (future, call), (success, value) in zip(batch, results):
+                    if success:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value[0])
+        finally:
+            self._batch = None
+
     def add(self, obj):
         print(obj)
+
+    def disconnect(self):
+        """Close the sockets of the client. Not close, which is proxied to the remote
+        object.
+        """
+        self.socket.close()
+        if self._sub is not None:
+            self._sub.close()
+        self.context.term()
+
+
+class _BenchmarkObject(object):
+    def work(self, duration):
+        time.sleep(duration)
+        return duration
+
+
+def benchmark_proxy(clients=(1, 2, 4, 8, 16), workers=(0, 8), calls=100, duration=1e-3, port=8123):
+    """Print the calls per second served by a ProxyServer with each number of workers, for
+    each number of concurrent clients. Each call takes duration seconds on the server.
+    """
+    print("{:>8} ".format("clients") + " ".join("{:>12}".format("workers=%s" % w) for w in workers))
+
+    for n in clients:
+        rates = []
+        for w in workers:
+            server = ProxyServer(port, workers=w)
+            server.add(_BenchmarkObject(), thread_safe=True)
+
+            def client():
+                c = ProxyClient(_BenchmarkObject(), port)
+                for i in range(calls):
+                    c.work(duration)
+                c.disconnect()
+
+            threads = [threading.Thread(target=client) for i in range(n)]
+            start = time.time()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            rates.append(n * calls / (time.time() - start))
+
+            server.close()
+
+        print("{:>8} ".format(n) + " ".join("{:>12.0f}".format(r) for r in rates))
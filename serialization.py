@@ -0,0 +1,182 @@
+"""Serializers for the messages of zmq.py and proxy.py.
+
+An object is sent as a tag frame naming its serializer, followed by the frames of the
+serializer, so that the receiver decodes each message with the serializer the sender
+picked:
+    - 'pickle': one pickle frame, highest protocol.
+    - 'pickle5': pickle protocol 5, the buffers of numpy arrays and other PickleBuffer
+      objects are sent as extra frames, copied once, or without copy.
+    - 'msgpack': msgpack with an extension type for numpy arrays, fast for small
+      messages. Needs msgpack.
+"""
+import pickle
+import time
+
+import numpy as np
+import zmq
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _buffer(frame):
+    """Returns the memory of a frame received with copy=False, or the frame itself.
+    """
+    return getattr(frame, 'buffer', frame)
+
+
+class PickleSerializer(object):
+    tag = b'pickle'
+
+    def dumps(self, obj, copy=True):
+        return [pickle.dumps(obj, -1)]
+
+    def loads(self, frames):
+        return pickle.loads(_buffer(frames[0]))
+
+
+class Pickle5Serializer(object):
+    """Arrays decoded from out-of-band frames share the memory of the received frames,
+    and are read-only.
+
+    Without copy, the out-of-band frames are the memory of the arrays of obj, which must
+    then not be modified until the frames are sent.
+    """
+    tag = b'pickle5'
+
+    def dumps(self, obj, copy=True):
+        buffers = []
+        data = pickle.dumps(obj, 5, buffer_callback=buffers.append)
+        if copy:
+            return [data] + [b.raw().tobytes() for b in buffers]
+        return [data] + [b.raw() for b in buffers]
+
+    def loads(self, frames):
+        return pickle.loads(_buffer(frames[0]), buffers=[_buffer(f) for f in frames[1:]])
+
+
+class MsgpackSerializer(object):
+    """Lists, dicts, strings, numbers and numpy arrays, tuples are decoded as lists.
+    """
+    tag = b'msgpack'
+
+    # msgpack extension type of numpy arrays
+    NDARRAY = 1
+
+    def dumps(self, obj, copy=True):
+        return [msgpack.packb(obj, default=self._default, use_bin_type=True)]
+
+    def loads(self, frames):
+        return msgpack.unpackb(_buffer(frames[0]), ext_hook=self._ext_hook, raw=False)
+
+    def _default(self, obj):
+        if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+            data = msgpack.packb([obj.dtype.str, list(obj.shape), np.ascontiguousarray(obj).tobytes()],
+                use_bin_type=True)
+            return msgpack.ExtType(self.NDARRAY, data)
+        if isinstance(obj, np.generic):
+            return obj.item()
+        raise TypeError("cannot serialize {} with msgpack".format(type(obj)))
+
+    def _ext_hook(self, code, data):
+        if code == self.NDARRAY:
+            dtype, shape, data = msgpack.unpackb(data, raw=False)
+            return np.frombuffer(data, dtype=dtype).reshape(shape)
+        return msgpack.ExtType(code, data)
+
+
+SERIALIZERS = {s.tag: s for s in (PickleSerializer(), Pickle5Serializer(), MsgpackSerializer())}
+
+# what every receiver can decode
+FALLBACK = SERIALIZERS[b'pickle']
+
+
+def available():
+    """Returns the names of the serializers usable in this interpreter.
+    """
+    names = ['pickle']
+    if pickle.HIGHEST_PROTOCOL >= 5:
+        names.append('pickle5')
+    if msgpack is not None:
+        names.append('msgpack')
+    return names
+
+
+def get_serializer(name=None):
+    """Returns the serializer called name, or the default: pickle5 where supported,
+    pickle otherwise.
+    """
+    if name is None:
+        name = 'pickle5' if 'pickle5' in available() else 'pickle'
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8')
+
+    if name.decode('utf-8') not in available():
+        raise ValueError("serializer {} is not available, expected one of {}".format(
+            name.decode('utf-8'), available()))
+    return SERIALIZERS[name]
+
+
+def dumps(obj, serializer=None, copy=True):
+    """Returns the frames of obj: the tag of the serializer and its frames.
+
+    serializer is a serializer, its name or None for the default. Without copy, the
+    frames can share the memory of the arrays of obj, which must then not be modified
+    until they are sent: for a request whose reply is waited for, not for a PUB socket.
+    """
+    if not hasattr(serializer, 'dumps'):
+        serializer = get_serializer(serializer)
+    return [serializer.tag] + serializer.dumps(obj, copy)
+
+
+def loads(frames):
+    """Returns the object from the frames of dumps.
+    """
+    tag = bytes(_buffer(frames[0]))
+    if tag not in SERIALIZERS:
+        raise ValueError("unknown serializer {}".format(tag))
+    return SERIALIZERS[tag].loads(frames[1:])
+
+
+def serializer_of(frames):
+    """Returns the serializer of the frames of dumps, to reply with the same one.
+    """
+    return SERIALIZERS[bytes(_buffer(frames[0]))]
+
+
+def benchmark_serializers(number=1000):
+    """Print the round trip latency, over an inproc socket pair, and the CPU time per
+    message of each available serializer, for messages of several sizes.
+    """
+    messages = [
+        ("small dict", {'t': 1.5, 'id': 3, 'name': 'sample'}),
+        ("1 KB array", np.random.rand(128)),
+        ("1 MB array", np.random.rand(2**17)),
+        ("16 MB array", np.random.rand(2**21)),
+    ]
+
+    context = zmq.Context()
+    a = context.socket(zmq.PAIR)
+    a.bind("inproc://benchmark-serializers")
+    b = context.socket(zmq.PAIR)
+    b.connect("inproc://benchmark-serializers")
+
+    print("{:>12} {:>10} {:>14} {:>14}".format("message", "serializer", "latency (us)", "CPU (us)"))
+
+    for label, message in messages:
+        # fewer repeats for the large messages
+        n = max(10, number * 1024 // max(1024, getattr(message, 'nbytes', 0)))
+        for name in available():
+            start, start_cpu = time.time(), time.process_time()
+            for i in range(n):
+                a.send_multipart(dumps(message, name), copy=False)
+                loads(b.recv_multipart(copy=False))
+            latency = (time.time() - start) / n
+            cpu = (time.process_time() - start_cpu) / n
+            print("{:>12} {:>10} {:>14.1f} {:>14.1f}".format(label, name, latency * 1e6, cpu * 1e6))
+
+    a.close()
+    b.close()
+    context.term()
@@ -0,0 +1,152 @@
+"""Stream recordings too large for memory in chunks of rows, through the windowing
+functions and the filters.
+
+The readers memory-map .npy and raw binary files, or read Parquet files one row group at
+a time, and yield 2-d arrays of rows. The chunks then go through window_chunks,
+reduce_chunks or filter_chunks, which carry the samples of the unfinished windows and
+the filter state from one chunk to the next: the output is the same as processing the
+whole recording at once, and only about one chunk is in memory at a time.
+
+    chunks = npy_chunks('recording.npy', chunk_size=2**20)
+    for derivs in filter_chunks(AxisFilterBank(3), chunks):
+        ...
+"""
+import numpy as np
+
+import windowing
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+def _chunks_of(data, chunk_size):
+    for start in range(0, len(data), chunk_size):
+        yield data[start:start + chunk_size]
+
+
+def npy_chunks(path, chunk_size=2**20):
+    """Yields read-only views of chunk_size rows of the array in a .npy file, read from
+    disk as they are used.
+    """
+    data = np.load(path, mmap_mode='r')
+    return _chunks_of(data, chunk_size)
+
+
+def raw_chunks(path, dtype, columns=None, chunk_size=2**20, offset=0):
+    """Yields read-only views of chunk_size rows of a raw binary file of dtype values,
+    with columns values per row if given, starting offset bytes into the file.
+    """
+    data = np.memmap(path, dtype=dtype, mode='r', offset=offset)
+    if columns is not None:
+        data = data[:len(data) // columns * columns].reshape(-1, columns)
+    return _chunks_of(data, chunk_size)
+
+
+def parquet_chunks(path, columns=None):
+    """Yields the row groups of a Parquet file, as 2-d arrays with one column per field
+    in columns, all by default. Needs pyarrow.
+    """
+    if pq is None:
+        raise ImportError("parquet_chunks needs pyarrow")
+
+    parquet = pq.ParquetFile(path)
+    for i in range(parquet.num_row_groups):
+        table = parquet.read_row_group(i, columns=columns)
+        yield np.column_stack([column.to_numpy() for column in table.columns])
+
+
+def rechunk(chunks, chunk_size):
+    """Yields chunks of exactly chunk_size rows, but the last one, from chunks of any size.
+    """
+    pending = []
+    n = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        n += len(chunk)
+        if n < chunk_size:
+            continue
+
+        data = np.concatenate(pending)
+        full = len(data) // chunk_size * chunk_size
+        for part in _chunks_of(data[:full], chunk_size):
+            yield part
+        pending = [data[full:]]
+        n = len(data) - full
+
+    if n:
+        yield np.concatenate(pending)
+
+
+def _carry(chunks, window_size, step, pad=False, fill_value=0):
+    """Yields the chunks preceded by the samples of the windows that did not fit in the
+    previous ones, with the number of full windows in each. With pad, the windows
+    overhanging the end of the recording come last, as the remaining samples padded with
+    fill_value.
+    """
+    carry = None
+    skip = 0
+    length = 0
+    count = 0
+    for chunk in chunks:
+        length += len(chunk)
+
+        # samples between two windows, when step > window_size
+        if skip:
+            dropped = min(skip, len(chunk))
+            chunk = chunk[dropped:]
+            skip -= dropped
+
+        data = chunk if carry is None or not len(carry) else np.concatenate([carry, chunk])
+        n = windowing.n_windows(len(data), window_size, step)
+        yield data, n
+        count += n
+
+        # the next window starts at n * step, and does not fit in data
+        skip += max(0, n * step - len(data))
+        carry = data[n * step:].copy()
+
+    if pad and carry is not None:
+        n = windowing.n_windows(length, window_size, step, pad=True) - count
+        if n:
+            tail = np.full(((n - 1) * step + window_size,) + carry.shape[1:], fill_value, carry.dtype)
+            tail[:len(carry)] = carry
+            yield tail, n
+
+
+def window_chunks(chunks, window_size, step=1, pad=False, fill_value=0):
+    """Yields the windows of the recording, as the views of the full windows of each
+    chunk, see windowing.windows. With pad, the windows overhanging the end of the
+    recording come last.
+    """
+    for data, n in _carry(chunks, window_size, step, pad, fill_value):
+        if n:
+            yield windowing.sliding_windows(data, window_size, step)
+
+
+def reduce_chunks(reduction, chunks, window_size, step=1, pad=False, fill_value=0, **kwargs):
+    """Yields reduction(data, window_size, step=step, ...) over the windows of each chunk,
+    reduction is one of windowing.window_mean, window_std, window_polyfit or window_fft,
+    with the extra kwargs, e.g. deg for window_polyfit.
+
+    The results per window are the same as over the whole recording, up to the floating
+    point rounding of the cumulative sums of window_mean and window_std and of the matrix
+    products of window_polyfit, which depend on the chunk boundaries.
+    """
+    for data, n in _carry(chunks, window_size, step, pad, fill_value):
+        if n:
+            yield reduction(data, window_size, step=step, **kwargs)
+
+
+def filter_chunks(axis_filter, chunks, time_column=0):
+    """Yields the output of axis_filter.batch_filter for each chunk, whose time_column
+    holds the timestamps and the other columns the values. The filter state carries over
+    from one chunk to the next, see functional.AxisFilter.
+    """
+    for chunk in chunks:
+        times = chunk[:, time_column]
+        values = np.delete(chunk, time_column, axis=1)
+        if values.shape[1] == 1 and axis_filter.channels is None:
+            values = values[:, 0]
+        yield axis_filter.batch_filter(times, values)
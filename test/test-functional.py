@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# test-functional.py: checks of functional.py, run from this directory.
+# Build cython/functional_c first to check the compiled new_sample too.
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import functional
+
+
+def random_walk(n_samples, channels, seed=0):
+    rng = np.random.RandomState(seed)
+    times = np.cumsum(rng.uniform(5, 15, n_samples))
+    return times, rng.randn(n_samples, channels).cumsum(axis=0)
+
+
+def test_reused_input_buffer():
+    """The filter state does not follow the caller's buffer once a sample is passed."""
+    times, values = random_walk(500, 3)
+
+    expected = functional.AxisFilterBank(3)
+    expected_rows = [expected.new_sample(t, v.copy()) for t, v in zip(times, values)]
+
+    af = functional.AxisFilterBank(3)
+    buf = np.empty(3)
+    rows = []
+    for t, v in zip(times, values):
+        buf[:] = v
+        rows.append(af.new_sample(t, buf))
+        buf[:] = np.nan
+    assert np.array_equal(np.concatenate(rows), np.concatenate(expected_rows))
+
+    # batch_filter keeps the last sample of its input
+    buf = values[:250].copy()
+    af = functional.AxisFilterBank(3)
+    out = af.batch_filter(times[:250], buf)
+    buf[:] = np.nan
+    out = np.r_[out, af.batch_filter(times[250:], values[250:])]
+    assert np.allclose(out, functional.AxisFilterBank(3).batch_filter(times, values))
+
+
+def test_strided_out():
+    """new_sample writes to out arrays which are not C-contiguous."""
+    times, values = random_walk(300, 2)
+    expected = functional.AxisFilterBank(2)
+    expected_rows = np.concatenate([expected.new_sample(t, v) for t, v in zip(times, values)])
+
+    width = expected_rows.shape[1]
+    for out in (np.zeros((10, 2*width))[:, ::2], np.zeros((10, width), order='F')):
+        af = functional.AxisFilterBank(2)
+        rows = []
+        for t, v in zip(times, values):
+            ns = af.new_sample(t, v, out=out)
+            assert not len(ns) or np.shares_memory(ns, out)
+            rows.append(ns.copy())
+        assert np.array_equal(np.concatenate(rows), expected_rows)
+
+    try:
+        functional.AxisFilterBank(2).new_sample(10., values[0], out=np.zeros((10, width + 1)))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("out of the wrong width accepted")
+
+
+def test_parallel_batch_filter_bit_exact():
+    """Channels filtered in groups by parallel_batch_filter give exactly the output of
+    batch_filter over all the channels."""
+    times, values = random_walk(20000, 5)
+    for filter_kwargs in ({}, {'engine': 'sos', 'derivative_number': 2}):
+        expected = functional.AxisFilter(channels=5, **filter_kwargs).batch_filter(times, values)
+        (result,), timings = functional.parallel_batch_filter([(times, values)], 2, 2,
+            **filter_kwargs)
+        assert len(timings) == 3
+        assert np.array_equal(result, expected), \
+            "differs by up to {}".format(np.abs(result - expected).max())
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("{}: ok".format(name))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# test-logging.py: checks of logging.py, run from this directory.
+
+import importlib.util
+import logging
+import os
+import threading
+
+# logging.py loaded under another name, it would hide the standard module
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+spec = importlib.util.spec_from_file_location("pyrecipes_logging", os.path.join(root, "logging.py"))
+plogging = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(plogging)
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_sample_filter_threads():
+    """SampleFilter lets exactly one record in every `every` through from many threads."""
+    log = plogging.message_logger('test-sample', every=10)
+    handler = ListHandler()
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+
+    def work():
+        for i in range(10000):
+            log.debug("%d", i)
+
+    threads = [threading.Thread(target=work) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    sample, = log.filters
+    assert len(handler.records) == 8000
+    assert sample.suppressed == 72000
+
+
+def test_message_logger_replaces_filters():
+    log = plogging.message_logger('test-replace', every=2)
+    log = plogging.message_logger('test-replace', rate=5, every=3)
+    assert sorted(type(f).__name__ for f in log.filters) == ['RateLimitFilter', 'SampleFilter']
+    assert [f.every for f in log.filters if isinstance(f, plogging.SampleFilter)] == [3]
+
+
+def test_dropping_queue_handler_stop():
+    """stop writes the queued records and can be called again."""
+    handler = ListHandler()
+    queue_handler = plogging.DroppingQueueHandler(100, handler)
+    log = logging.getLogger('test-queue')
+    log.addHandler(queue_handler)
+    log.propagate = False
+    for i in range(10):
+        log.warning("%d", i)
+
+    queue_handler.stop()
+    queue_handler.stop()
+    assert [r.getMessage() for r in handler.records] == [str(i) for i in range(10)]
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("{}: ok".format(name))
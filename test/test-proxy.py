@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# test-proxy.py: checks of proxy.py, run from this directory.
+
+import os
+import sys
+
+# appended, so that the modules of this repository do not hide the packages of the
+# same names, e.g. zmq
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import proxy
+
+PORT = 18123
+
+
+def shout(text):
+    return text.upper()
+
+
+class Served(object):
+    def __init__(self):
+        self.handler = shout
+        self.name = 'served'
+
+    def method(self, x):
+        return 2 * x
+
+    @property
+    def value(self):
+        return 42
+
+
+def test_callable_instance_attribute():
+    """A function stored on the instance is called remotely, not read as a property."""
+    obj = Served()
+    server = proxy.ProxyServer(PORT)
+    server.add(obj)
+    client = proxy.ProxyClient(obj, PORT)
+    try:
+        assert client.handler('abc') == 'ABC'
+        assert client.method(2) == 4
+        assert client.value == 42
+        assert client.name == 'served'
+    finally:
+        client.disconnect()
+        server.close()
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("{}: ok".format(name))
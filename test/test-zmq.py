@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# test-zmq.py: checks of zmq.py, run from this directory.
+
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import zmq
+
+# appended, so that the modules of this repository do not hide the packages of the
+# same names, and zmq.py loaded under another name
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(root)
+spec = importlib.util.spec_from_file_location("pyrecipes_zmq", os.path.join(root, "zmq.py"))
+pzmq = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(pzmq)
+
+PORT = 18555
+
+
+def echo_server(context, stop, delay):
+    rep = context.socket(zmq.REP)
+    rep.bind("tcp://127.0.0.1:{}".format(PORT))
+    while not stop.is_set():
+        if rep.poll(50):
+            request = rep.recv_pyobj()
+            time.sleep(delay)
+            rep.send_pyobj(request)
+    rep.close()
+
+
+def test_cancel_in_flight():
+    """Cancelling futures while their requests are in flight does not stop the client."""
+    context = zmq.Context()
+    stop = threading.Event()
+    server = threading.Thread(target=echo_server, args=(context, stop, 5e-3))
+    server.start()
+
+    client = pzmq.PipelinedLPClient(["tcp://127.0.0.1:{}".format(PORT)], REQUEST_TIMEOUT=5000)
+    try:
+        assert client.send_pyobj('before', timeout=10) == 'before'
+
+        # cancelled right away, and once the first reply shows the requests were sent
+        futures = [client.submit(str(i)) for i in range(100)]
+        for f in futures[1::2]:
+            f.cancel()
+        futures[0].result(10)
+        # claimed by the client thread when sent, they run to their reply
+        assert not any(f.cancel() for f in futures[2::2])
+
+        for i, f in enumerate(futures):
+            if not f.cancelled():
+                assert f.result(10) == str(i)
+        assert client._thread.is_alive()
+        assert client.send_pyobj('after', timeout=10) == 'after'
+    finally:
+        client.close()
+        stop.set()
+        server.join()
+        context.term()
+
+
+def test_shm_ring_size():
+    """A ring larger than the free space of /dev/shm raises OSError, not SIGBUS."""
+    stat = os.statvfs('/dev/shm')
+    try:
+        pzmq.SharedMemoryRing(slots=2, slot_size=stat.f_bavail * stat.f_frsize)
+    except OSError:
+        pass
+    else:
+        raise AssertionError("ring larger than /dev/shm created")
+
+
+def test_shm_rings_released():
+    """Publisher.close detaches the ring that decode_message attached by default."""
+    publisher = pzmq.Publisher(PORT, local=True, slots=2, slot_size=2**16)
+    subscriber = publisher.context.socket(zmq.SUB)
+    subscriber.connect(publisher.endpoint)
+    subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
+    while not subscriber.poll(10):
+        publisher.send_message("warmup", np.zeros(4))
+
+    header, message = pzmq.decode_message(subscriber.recv_multipart(copy=False))
+    assert header == "warmup" and np.array_equal(message, np.zeros(4))
+    assert publisher.ring.name in pzmq._rings
+
+    name = publisher.ring.name
+    subscriber.close()
+    publisher.close()
+    assert name not in pzmq._rings
+    assert not os.path.exists(os.path.join('/dev/shm', name.lstrip('/')))
+
+
+def test_scalar_array_round_trip():
+    """0-d arrays keep their shape, as raw buffers and through shared memory."""
+    ring = pzmq.SharedMemoryRing(slots=2, slot_size=64)
+    rings = {}
+    try:
+        for message in (np.array(1.5), np.array(7, dtype=np.int16), np.zeros((2, 0)),
+                np.arange(6.).reshape(2, 3).T):
+            for kwargs in (dict(), dict(copy=False), dict(ring=ring)):
+                frames = [zmq.Frame(f) for f in pzmq.encode_message("h", message, **kwargs)]
+                header, decoded = pzmq.decode_message(frames, rings)
+                assert decoded.shape == message.shape and decoded.dtype == message.dtype
+                assert np.array_equal(decoded, message)
+    finally:
+        for r in rings.values():
+            r.close()
+        ring.close()
+
+
+if __name__ == '__main__':
+    for name, test in sorted(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print("{}: ok".format(name))
@@ -0,0 +1,193 @@
+"""Windows over the first axis of an array, as read-only views of the data.
+
+Windows start every step samples, step = window_size - overlap. The full windows are a
+view of the data, whatever its memory layout, and padding the windows that overhang the
+end only copies the last few samples. The reductions run over blocks of windows, so that
+the (n_windows, window_size, ...) tensor is never built for the whole data.
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# number of window elements processed at once by the reductions
+CHUNK_ELEMENTS = 2**22
+
+
+def n_windows(length, window_size, step=1, pad=False):
+    """Returns the number of windows in length samples, with pad the number of windows
+    needed for every sample to be in one of them, or to start before the end when
+    step > window_size.
+    """
+    if length < window_size:
+        return 1 if pad and length > 0 else 0
+    if pad:
+        return min(-(-(length - window_size) // step) + 1, -(-length // step))
+    return (length - window_size) // step + 1
+
+
+def sliding_windows(data, window_size, step=1):
+    """Returns the view of the full windows of data.
+
+    Args:
+        data (array): array of shape (n_samples, ...), any strides.
+        window_size (int): number of samples in a window.
+        step (int): number of samples between the starts of two windows.
+
+    Returns:
+        read-only view of shape (n_windows, window_size, ...).
+    """
+    data = np.asarray(data)
+    if len(data) < window_size:
+        return np.empty((0, window_size) + data.shape[1:], data.dtype)
+
+    # the window axis is last in sliding_window_view
+    windows = sliding_window_view(data, window_size, axis=0)[::step]
+    return np.moveaxis(windows, -1, 1)
+
+
+def _tail(data, window_size, step, fill_value):
+    """Returns the samples of the windows overhanging the end of data, padded with
+    fill_value, and the number of those windows.
+    """
+    n_full = n_windows(len(data), window_size, step)
+    n_tail = n_windows(len(data), window_size, step, pad=True) - n_full
+    if n_tail == 0:
+        return None, 0
+
+    start = n_full * step
+    tail = np.full(((n_tail - 1) * step + window_size,) + data.shape[1:], fill_value, data.dtype)
+    tail[:len(data) - start] = data[start:]
+    return tail, n_tail
+
+
+def windows(data, window_size, step=1, pad=False, fill_value=0):
+    """Returns the full windows and, with pad, the windows overhanging the end of data.
+
+    Only the samples of the last windows are copied: the windows of the whole data are
+    np.concatenate((full, tail)), or pad_to_windows when one array is needed.
+
+    Returns:
+        full (array): view of shape (n_windows, window_size, ...), see sliding_windows.
+        tail (array): windows padded with fill_value, None without pad or when the windows
+            end with the data.
+    """
+    data = np.asarray(data)
+    full = sliding_windows(data, window_size, step)
+    tail, n_tail = _tail(data, window_size, step, fill_value) if pad else (None, 0)
+    if tail is not None:
+        tail = sliding_windows(tail, window_size, step)
+    return full, tail
+
+
+def pad_to_windows(data, window_size, step=1, fill_value=0):
+    """Returns data, or a copy padded with fill_value when windows overhang its end.
+    """
+    data = np.asarray(data)
+    n = n_windows(len(data), window_size, step, pad=True)
+    length = (n - 1) * step + window_size if n else 0
+    if length <= len(data):
+        return data
+
+    padded = np.full((length,) + data.shape[1:], fill_value, data.dtype)
+    padded[:len(data)] = data
+    return padded
+
+
+def _blocks(data, window_size, step, pad, fill_value):
+    """Yields the blocks of samples of the windows, with their number of windows, about
+    CHUNK_ELEMENTS window elements at a time. Consecutive blocks overlap.
+    """
+    data = np.asarray(data)
+    row = int(np.prod(data.shape[1:]))
+    chunk = max(1, CHUNK_ELEMENTS // (window_size * row))
+
+    n_full = n_windows(len(data), window_size, step)
+    for k in range(0, n_full, chunk):
+        n = min(chunk, n_full - k)
+        yield data[k * step:(k + n - 1) * step + window_size], n
+
+    if pad:
+        tail, n_tail = _tail(data, window_size, step, fill_value)
+        if tail is not None:
+            yield tail, n_tail
+
+
+def _reduce(func, data, window_size, step, pad, fill_value, shape, dtype=float):
+    """Concatenates func(block, n) over the blocks, shape and dtype are those of the result
+    of one window.
+    """
+    results = [func(block, n) for block, n in _blocks(data, window_size, step, pad, fill_value)]
+    if not results:
+        return np.empty((0,) + shape, dtype)
+    return np.concatenate(results)
+
+
+def _window_sums(block, n, window_size, step):
+    """Returns the sums of the n windows of block, from its cumulative sum.
+    """
+    c = np.empty((len(block) + 1,) + block.shape[1:])
+    c[0] = 0
+    np.cumsum(block, axis=0, out=c[1:])
+    starts = np.arange(n) * step
+    return c[starts + window_size] - c[starts]
+
+
+def window_mean(data, window_size, step=1, pad=False, fill_value=0):
+    """Returns the mean of each window, of shape (n_windows, ...).
+    """
+    data = np.asarray(data)
+
+    def mean(block, n):
+        return _window_sums(block, n, window_size, step) / window_size
+
+    return _reduce(mean, data, window_size, step, pad, fill_value, data.shape[1:])
+
+
+def window_std(data, window_size, step=1, pad=False, fill_value=0, ddof=0):
+    """Returns the standard deviation of each window, of shape (n_windows, ...).
+    """
+    data = np.asarray(data)
+
+    def std(block, n):
+        # centered on the block, for the sums of squares to stay accurate
+        block = block - block.mean(axis=0)
+        s1 = _window_sums(block, n, window_size, step)
+        s2 = _window_sums(block**2, n, window_size, step)
+        var = (s2 - s1**2 / window_size) / (window_size - ddof)
+        return np.sqrt(np.maximum(var, 0))
+
+    return _reduce(std, data, window_size, step, pad, fill_value, data.shape[1:])
+
+
+def window_polyfit(data, window_size, deg, step=1, pad=False, fill_value=0):
+    """Returns the least squares polynomial fit of each window, against the sample index
+    in the window, of shape (n_windows, deg + 1, ...), highest power first as np.polyfit.
+    """
+    data = np.asarray(data)
+
+    # the fit is linear in the samples
+    x = np.arange(window_size, dtype=float)
+    coeffs = np.linalg.pinv(np.vander(x, deg + 1))
+
+    def polyfit(block, n):
+        w = sliding_windows(block, window_size, step)[:n]
+        return np.moveaxis(np.tensordot(w, coeffs, axes=([1], [1])), -1, 1)
+
+    return _reduce(polyfit, data, window_size, step, pad, fill_value, (deg + 1,) + data.shape[1:])
+
+
+def window_fft(data, window_size, step=1, pad=False, fill_value=0, taper=None):
+    """Returns the real FFT of each window, multiplied by taper if given, e.g.
+    np.hanning(window_size), of shape (n_windows, window_size // 2 + 1, ...).
+    """
+    data = np.asarray(data)
+    if taper is not None:
+        taper = np.asarray(taper).reshape((window_size,) + (1,) * (data.ndim - 1))
+
+    def fft(block, n):
+        w = sliding_windows(block, window_size, step)[:n]
+        if taper is not None:
+            w = w * taper
+        return np.fft.rfft(w, axis=1)
+
+    return _reduce(fft, data, window_size, step, pad, fill_value, (window_size // 2 + 1,) + data.shape[1:],
+        complex)
@@ -1,73 +1,490 @@
 import zmq
+import zmq.asyncio
+import atexit
+import collections
+import concurrent.futures
+import errno
+import itertools
+import os
+import struct
+import tempfile
 import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
 
+import numpy as np
 import six
 from six.moves import queue
+from six.moves import cPickle as pickle
 import logging
 
+import serialization
+
+logger = logging.getLogger(__name__)
+# per-message logs, see logging.message_logger to rate limit them
+message_logger = logging.getLogger(__name__ + '.messages')
+
+# serializer tag of the numpy arrays sent as raw buffers
+RAW_ARRAY = b'ndarray'
+# serializer tag of the numpy arrays written in a SharedMemoryRing
+SHM_ARRAY = b'shm-ndarray'
+
+# rings attached by decode_message when the caller does not keep its own, see close_rings
+_rings = {}
+
+
+def local_endpoint(port):
+    """Returns the ipc endpoint of the local publisher on port.
+    """
+    return "ipc://{}".format(os.path.join(tempfile.gettempdir(), "pyrecipes-zmq-{}".format(port)))
+
+
+def topic(header):
+    """Returns the topic frame of a header, used by subscribers to filter messages.
+    """
+    if isinstance(header, bytes):
+        return header
+    return six.text_type(header).encode('utf-8')
+
+
+def encode_message(header, message, raw_arrays=True, serializer=None, ring=None, copy=True):
+    """Returns the frames for [header, message].
+
+    The first frame is the topic of the header. Numpy arrays are then sent as the
+    RAW_ARRAY tag, a small pickled (header, dtype, shape) frame and the raw array buffer:
+    a copy of the array or, without copy, the array itself, which must then not be
+    modified until it is sent. Any other message is sent as the frames of
+    serialization.dumps, with serializer, the default one if None.
+
+    With a SharedMemoryRing, the arrays that fit in its slots are written there instead,
+    and only the SHM_ARRAY tag and a pickled (header, dtype, shape, ring name, slot,
+    sequence number) frame are sent.
+    """
+    if raw_arrays and isinstance(message, np.ndarray) and not message.dtype.hasobject:
+        # ascontiguousarray makes 0-d arrays 1-d, the shape is sent as it was
+        shape = message.shape
+        message = np.ascontiguousarray(message)
+        if ring is not None and message.nbytes <= ring.slot_size:
+            slot, seq = ring.write(message)
+            meta = pickle.dumps((header, message.dtype.str, shape, ring.name, slot, seq), -1)
+            return [topic(header), SHM_ARRAY, meta]
+        if copy:
+            message = message.copy()
+        meta = pickle.dumps((header, message.dtype.str, shape), -1)
+        return [topic(header), RAW_ARRAY, meta, message]
+
+    return [topic(header)] + serialization.dumps([header, message], serializer, copy)
+
+
+def decode_message(frames, rings=None):
+    """Returns [header, message] from the frames of encode_message. Arrays are built on
+    top of the received buffer, without copy.
+
+    Arrays in shared memory are copied out of their slot, the rings are attached by name
+    and kept in the rings dict, or in a dict of the module by default. Returns None when
+    the slot was overwritten before the copy ended.
+    """
+    tag = frames[1].bytes
+    if tag == SHM_ARRAY:
+        if rings is None:
+            rings = _rings
+        header, dtype, shape, name, slot, seq = pickle.loads(frames[2].bytes)
+        if name not in rings:
+            rings[name] = SharedMemoryRing(name, create=False)
+        message = rings[name].read(slot, seq, dtype, shape)
+        return None if message is None else [header, message]
+
+    if tag != RAW_ARRAY:
+        return list(serialization.loads(frames[1:]))
+
+    header, dtype, shape = pickle.loads(frames[2].bytes)
+    message = np.frombuffer(frames[3].buffer, dtype=dtype).reshape(shape)
+    return [header, message]
+
+
+def close_rings(names=None):
+    """Detach the rings attached by decode_message without a rings dict, those of names
+    or all of them. They are attached again by the next message that needs them.
+    """
+    for name in list(_rings) if names is None else names:
+        ring = _rings.pop(name, None)
+        if ring is not None:
+            ring.close()
+
+atexit.register(close_rings)
+
+
+class SharedMemoryRing(object):
+    """A ring of fixed size slots in shared memory, written by one process and read by
+    any number of processes on the same host.
+
+    Each slot has a sequence number, odd while the slot is written and even once done,
+    which changes with every write. A reader copies the slot out and then checks that the
+    sequence number is still the one sent with the message: otherwise the writer came
+    back to the slot before, or during, the copy and the data is discarded.
+
+    Args:
+        name (str): name of the shared memory block, a new name by default.
+        slots (int): number of slots, how many messages a reader can lag behind.
+        slot_size (int): size of a slot in bytes, the largest array sent through the ring.
+        create (bool): create the block, the writer, or attach to it, a reader.
+
+    The block, about slots * slot_size bytes, must fit in the free space of /dev/shm,
+    64 MB by default in docker containers. Its pages are all touched on creation, a
+    block that does not fit would kill the process with SIGBUS: OSError is raised
+    instead.
+    """
+    # the header holds slots and slot_size, then the sequence numbers
+    HEADER = 64
+
+    # names of the blocks created by this process
+    _created = set()
+
+    def __init__(self, name=None, slots=4, slot_size=2**22, create=True):
+        super(SharedMemoryRing, self).__init__()
+
+        if create:
+            header = self.HEADER + 64 * ((8 * slots + 63) // 64)
+            size = header + slots * slot_size
+            if os.path.isdir('/dev/shm'):
+                stat = os.statvfs('/dev/shm')
+                if size > stat.f_bavail * stat.f_frsize:
+                    raise OSError(errno.ENOSPC, "a ring of {} bytes does not fit in the {} bytes "
+                        "free in /dev/shm".format(size, stat.f_bavail * stat.f_frsize))
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+            np.ndarray((2,), np.uint64, self.shm.buf)[:] = (slots, slot_size)
+            SharedMemoryRing._created.add(self.shm.name)
+        else:
+            self.shm = shared_memory.SharedMemory(name)
+            # the writer unlinks the block, not the resource tracker of a reader
+            if self.shm.name not in SharedMemoryRing._created:
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            slots, slot_size = [int(v) for v in np.ndarray((2,), np.uint64, self.shm.buf)]
+            header = self.HEADER + 64 * ((8 * slots + 63) // 64)
+
+        self.name = self.shm.name
+        self.slots = slots
+        self.slot_size = slot_size
+        self.create = create
+
+        self.seq = np.ndarray((slots,), np.uint64, self.shm.buf, offset=self.HEADER)
+        self.data = np.ndarray((slots, slot_size), np.uint8, self.shm.buf, offset=header)
+
+        # fault the pages in now rather than on the first write of each slot
+        if create:
+            self.data.fill(0)
+
+        self._count = 0
+
+    def write(self, array):
+        """Copy a contiguous array in the next slot. Returns its slot and sequence number.
+        """
+        slot = self._count % self.slots
+        seq = 2 * self._count + 1
+        self._count += 1
+
+        self.seq[slot] = seq
+        self.data[slot, :array.nbytes] = array.reshape(-1).view(np.uint8)
+        self.seq[slot] = seq + 1
+        return slot, seq + 1
+
+    def read(self, slot, seq, dtype, shape):
+        """Returns a copy of the array written in slot with sequence number seq, or None
+        if it was overwritten.
+        """
+        if self.seq[slot] != seq:
+            return None
+
+        dtype = np.dtype(dtype)
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        array = self.data[slot, :nbytes].view(dtype).reshape(shape).copy()
+
+        if self.seq[slot] != seq:
+            return None
+        return array
+
+    def close(self):
+        # the views hold the buffer
+        del self.seq, self.data
+        self.shm.close()
+        if self.create:
+            self.shm.unlink()
+            SharedMemoryRing._created.discard(self.shm.name)
+
+
+class MessageQueue(object):
+    """Thread-safe FIFO with the get/put interface of queue.Queue.
+
+    It holds at most maxsize items, 0 for no limit. When full, put does not block but
+    drops the oldest item ('drop-oldest') or the new one ('drop-newest'), and counts it
+    in dropped.
+    """
+    def __init__(self, maxsize=0, policy='drop-oldest'):
+        super(MessageQueue, self).__init__()
+
+        if policy not in ('drop-oldest', 'drop-newest'):
+            raise ValueError("unknown policy {}, expected 'drop-oldest' or 'drop-newest'".format(policy))
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+
+        self._items = collections.deque()
+        self._not_empty = threading.Condition(threading.Lock())
+
+    def put(self, item, block=True, timeout=None):
+        with self._not_empty:
+            if self.maxsize and len(self._items) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == 'drop-newest':
+                    return
+                self._items.popleft()
+
+            self._items.append(item)
+            self._not_empty.notify()
+
+    def put_nowait(self, item):
+        self.put(item, False)
+
+    def put_many(self, items):
+        """Put all the items, taking the lock once.
+        """
+        with self._not_empty:
+            for item in items:
+                if self.maxsize and len(self._items) >= self.maxsize:
+                    self.dropped += 1
+                    if self.policy == 'drop-newest':
+                        continue
+                    self._items.popleft()
+                self._items.append(item)
+            self._not_empty.notify_all()
+
+    def get(self, block=True, timeout=None):
+        with self._not_empty:
+            if not self._wait(block, timeout):
+                raise queue.Empty
+            return self._items.popleft()
+
+    def get_batch(self, max_n=100, timeout=None):
+        """Returns a list of up to max_n items, taking the lock once. Waits for timeout
+        seconds, or forever if None, for the first item, returns an empty list if none came.
+        """
+        with self._not_empty:
+            self._wait(True, timeout)
+            return [self._items.popleft() for i in range(min(max_n, len(self._items)))]
+
+    def _wait(self, block, timeout):
+        """Wait for an item, with the lock held. Returns whether there is one.
+        """
+        if not block or timeout is not None:
+            endtime = time.time() + (timeout or 0)
+            while not self._items:
+                remaining = endtime - time.time()
+                if remaining <= 0:
+                    return False
+                self._not_empty.wait(remaining)
+        else:
+            while not self._items:
+                self._not_empty.wait()
+        return True
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        return len(self._items)
+
+    def empty(self):
+        return not self._items
+
+
 class Publisher(object):
-    def __init__(self, port=8765):
+    """Publish [header, message] pairs, see encode_message.
+
+    Args:
+        port (int): port to bind to on localhost.
+        raw_arrays (bool): send numpy arrays as raw buffers instead of serializing them.
+        serializer (str): 'pickle', 'pickle5' or 'msgpack' for the other messages, see
+            serialization. The subscribers decode any of them.
+        local (bool): for subscribers on the same host only, bind an ipc endpoint, see
+            local_endpoint, and write the arrays in a SharedMemoryRing.
+        slots (int), slot_size (int): size of the ring, when local, see SharedMemoryRing.
+        zero_copy (bool): send the arrays, also those serialized by pickle5, without
+            copying them, the caller must then not modify them until they are sent, see
+            send_message.
+    """
+    def __init__(self, port=8765, raw_arrays=True, serializer=None, local=False, slots=4,
+        slot_size=2**22, zero_copy=False):
         super(Publisher, self).__init__()
+        self.raw_arrays = raw_arrays
+        self.zero_copy = zero_copy
+        self.serializer = serialization.get_serializer(serializer)
+        self.ring = SharedMemoryRing(slots=slots, slot_size=slot_size) if local else None
+        self.endpoint = local_endpoint(port) if local else "tcp://127.0.0.1:{}".format(port)
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.PUB)
-        self.socket.bind("tcp://127.0.0.1:{}".format(port))
+        self.socket.bind(self.endpoint)
 
     def send_message(self, header, message):
-        self.socket.send_pyobj([header, message])
+        """Send [header, message]. With zero_copy, returns the zmq.MessageTracker of the
+        message: the arrays can be modified once its done is True, or after its wait().
+        """
+        frames = encode_message(header, message, self.raw_arrays, self.serializer, self.ring,
+            copy=not self.zero_copy)
+        return self.socket.send_multipart(frames, copy=False, track=self.zero_copy)
 
     def close(self):
         self.socket.close()
         self.context.term()
+        if self.ring is not None:
+            # and the attachment of decode_message in this process, if any
+            close_rings([self.ring.name])
+            self.ring.close()
 
 
 class ThreadedSubscriber(threading.Thread):
     """Threaded and non-blocking.
+
+    Every wakeup of the thread drains all the messages ready on the socket, up to
+    max_batch, and puts them in the queues at once. Consumers can take them in batches
+    with get_batch. stop wakes the thread through an inproc control socket.
+
+    Args:
+        port (int): port of the publisher on localhost.
+        topics (list): topics to subscribe to, matched on their prefix by the socket.
+            All messages by default.
+        maxsize (int): maximum number of messages kept in a queue, 0 for no limit.
+        policy (str): 'drop-oldest' or 'drop-newest', what to drop when a queue is full.
+        per_topic (bool): put the messages of each topic in their own queue, see queue(),
+            instead of dataqueue.
+        max_batch (int): maximum number of messages read in one wakeup.
+        local (bool): connect to the local endpoint of a Publisher with local=True. The
+            arrays overwritten in shared memory before being read are counted in
+            overwritten.
     """
-    def __init__(self, port=8765):
+    def __init__(self, port=8765, topics=None, maxsize=0, policy='drop-oldest', per_topic=False,
+        max_batch=1000, local=False):
 
         super(ThreadedSubscriber, self).__init__()
+        self.context = zmq.Context()
+        self.control_endpoint = "inproc://threaded-subscriber-{}".format(id(self))
+        self.max_batch = max_batch
+
         self.is_looping = threading.Event()
-        self.dataqueue = queue.Queue()
+        self.dataqueue = MessageQueue(maxsize, policy)
         self.Empty = queue.Empty
         self.port = port
 
+        self.topics = [""] if topics is None else list(topics)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.per_topic = per_topic
+
+        self.endpoint = local_endpoint(port) if local else "tcp://127.0.0.1:{}".format(port)
+        self.rings = {}
+        self.overwritten = 0
+
+        self.queues = {}
+        self._queues_lock = threading.Lock()
+
+    def queue(self, header):
+        """Returns the queue of the messages of the topic of header, with per_topic. The
+        queues are keyed by the topic frames, as bytes, see topic().
+        """
+        key = topic(header)
+        with self._queues_lock:
+            if key not in self.queues:
+                self.queues[key] = MessageQueue(self.maxsize, self.policy)
+            return self.queues[key]
+
+    def get_batch(self, max_n=100, timeout=None, topic=None):
+        """Returns a list of up to max_n messages, from dataqueue or the queue of topic.
+        """
+        q = self.dataqueue if topic is None else self.queue(topic)
+        return q.get_batch(max_n, timeout)
+
     def run(self):
 
         # 0mq socket
-        self.context = zmq.Context()
         self.socket = self.context.socket(zmq.SUB)
-        self.socket.connect("tcp://127.0.0.1:{}".format(self.port))
-        self.socket.setsockopt_string(zmq.SUBSCRIBE, "")
+        self.socket.connect(self.endpoint)
+        for t in self.topics:
+            self.socket.setsockopt_string(zmq.SUBSCRIBE, six.text_type(t))
+
+        # stop() sends on this socket to wake the thread
+        self.control = self.context.socket(zmq.PAIR)
+        self.control.bind(self.control_endpoint)
 
         # 0mq poller
         self.poller = zmq.Poller()
         self.poller.register(self.socket, zmq.POLLIN)
+        self.poller.register(self.control, zmq.POLLIN)
 
         self.is_looping.set()
 
         while self.is_looping.is_set():
-            socks = dict(self.poller.poll(500))  # timeout for triggering stop
+            socks = dict(self.poller.poll())
+
+            if socks.get(self.control) == zmq.POLLIN:
+                self.control.recv()
+                break
+
+            if socks.get(self.socket) == zmq.POLLIN:
+                self.drain()
 
-            # if socks.get(self.socket) == zmq.POLLIN:
-            if self.socket in socks and socks[self.socket] == zmq.POLLIN:
-                data = self.socket.recv_pyobj()
-                self.dataqueue.put(data)
+        logger.info('tp quit')
 
-        logging.info('tp quit')
+    def drain(self):
+        """Read all the messages ready on the socket, up to max_batch, and put them in
+        their queues, one batch per queue.
+        """
+        batches = collections.defaultdict(list)
+
+        for i in range(self.max_batch):
+            try:
+                frames = self.socket.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                break
+
+            message = decode_message(frames, self.rings)
+            if message is None:
+                self.overwritten += 1
+                continue
+
+            # any bytes, not necessarily utf-8
+            t = frames[0].bytes if self.per_topic else None
+            batches[t].append(message)
+
+        for t, batch in batches.items():
+            q = self.dataqueue if t is None else self.queue(t)
+            q.put_many(batch)
 
 
     def stop(self):
-        logging.info('call stop')
+        logger.info('call stop')
         self.is_looping.clear()
+
+        control = self.context.socket(zmq.PAIR)
+        control.connect(self.control_endpoint)
+        control.send(b'')
+
         self.join()  # wait for thread to finish
+        control.close()
+        self.control.close()
         self.socket.close()
         self.context.term()
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
 
 
 class LPClient(object):
     """Lazy Pirate Client, will connect to a server with polling, does 
     REQUEST_RETRIES tries with REQUEST_TIMEOUT before closing. Execute in main
     thread with blocking.
+
+    Requests are sent as a single pickle frame, as with send_pyobj, or with the frames of
+    serialization.dumps when a serializer is given, the server must then reply the same way.
     """
 
     def __init__(self, 
@@ -75,12 +492,14 @@ class LPClient(object):
         port,
         REQUEST_TIMEOUT = 2500,
         REQUEST_RETRIES = 3,
+        serializer = None,
         ):
 
         super(LPClient, self).__init__()
 
         self.REQUEST_TIMEOUT = REQUEST_TIMEOUT
         self.REQUEST_RETRIES = REQUEST_RETRIES
+        self.serializer = None if serializer is None else serialization.get_serializer(serializer)
         self.SERVER_ENDPOINT = "tcp://"+server+":%s" % port
 
         logger.info(self.SERVER_ENDPOINT)
@@ -99,25 +518,25 @@ class LPClient(object):
 
         while retries_left:
 
-            logger.info("I: Sending (%s)" % request)
-            self.client.send_pyobj(request)
+            message_logger.debug("I: Sending (%s)", request)
+            self._send(request)
 
             expect_reply = True
             while expect_reply:
                 socks = dict(self.poll.poll(self.REQUEST_TIMEOUT))
 
                 if socks.get(self.client) == zmq.POLLIN:
-                    reply = self.client.recv_pyobj()
+                    reply = self._recv()
 
                     if not reply:
                         break
 
                     if reply: ## reply code is ok
-                        logger.info("I: Server replied OK (%s)" % reply)
+                        message_logger.debug("I: Server replied OK (%s)", reply)
                         retries_left = 0#self.REQUEST_RETRIES
                         expect_reply = False
                     else:
-                        logger.info("E: Malformed reply from server: %s" % reply)
+                        logger.info("E: Malformed reply from server: %s", reply)
 
                 else:
                     logger.info("W: No response from server, retrying")
@@ -130,14 +549,421 @@ class LPClient(object):
                         logger.info("E: Server seems to be offline, abandoning")
                         raise ConnectionError(self.SERVER_ENDPOINT+' is offline', 0)
                         # break
-                    logger.info("I: Reconnecting and resending (%s)" % request)
+                    logger.info("I: Reconnecting and resending (%s)", request)
 
                     # Create new connection
                     self.client = self.context.socket(zmq.REQ)
                     self.client.connect(self.SERVER_ENDPOINT)
                     self.poll.register(self.client, zmq.POLLIN)
-                    self.client.send_pyobj(request)
+                    self._send(request)
+
+    def _send(self, request):
+        if self.serializer is None:
+            self.client.send_pyobj(request)
+        else:
+            # the reply is waited for, the request is sent by then
+            self.client.send_multipart(serialization.dumps(request, self.serializer, copy=False),
+                copy=False)
+
+    def _recv(self):
+        if self.serializer is None:
+            return self.client.recv_pyobj()
+        return serialization.loads(self.client.recv_multipart(copy=False))
 
     def term(self):
         ## could be put in a enter/exit
         self.context.term()
+
+
+class PipelinedLPClient(object):
+    """Lazy Pirate Client with many requests in flight, over DEALER sockets.
+
+    Each request is sent as [id, '', request]. REP servers keep the frames before the
+    empty delimiter as envelope and send them back with the reply, so that replies are
+    matched to their request by id, in any order. A request without reply after
+    REQUEST_TIMEOUT ms is resent, REQUEST_RETRIES tries in total, then its future fails
+    with ConnectionError.
+
+    With several endpoints, requests are spread over the servers in turn, and a resent
+    request goes to the next server, so that a server going down fails over to the
+    others. The sockets are owned by a background thread, submit can be called from any
+    thread. A future can be cancelled until its request is sent, it then runs to its reply.
+
+    Args:
+        endpoints (list): server endpoints, e.g. ["tcp://127.0.0.1:5555"].
+    """
+    def __init__(self,
+        endpoints,
+        REQUEST_TIMEOUT = 2500,
+        REQUEST_RETRIES = 3,
+        ):
+
+        super(PipelinedLPClient, self).__init__()
+
+        self.REQUEST_TIMEOUT = REQUEST_TIMEOUT
+        self.REQUEST_RETRIES = REQUEST_RETRIES
+        self.endpoints = [endpoints] if isinstance(endpoints, six.string_types) else list(endpoints)
+
+        self.context = zmq.Context()
+        self._ids = itertools.count()
+        self._outgoing = queue.Queue()
+
+        # id: [future, request, deadline, retries_left, endpoint], in order of deadline
+        self._pending = collections.OrderedDict()
+
+        # wakes the background thread when requests are submitted
+        control_endpoint = "inproc://pipelined-lpclient-{}".format(id(self))
+        self._control = self.context.socket(zmq.PAIR)
+        self._control.bind(control_endpoint)
+        self._wake = self.context.socket(zmq.PAIR)
+        self._wake.connect(control_endpoint)
+        self._wake_lock = threading.Lock()
+
+        self.is_looping = threading.Event()
+        self.is_looping.set()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, request):
+        """Send request, returns a concurrent.futures.Future of the reply.
+        """
+        future = concurrent.futures.Future()
+        request_id = struct.pack(">Q", next(self._ids))
+        self._outgoing.put((request_id, pickle.dumps(request, -1), future))
+        self._signal()
+        return future
+
+    def send_pyobj(self, request, timeout=None):
+        """Send request and wait for the reply.
+        """
+        return self.submit(request).result(timeout)
+
+    def _signal(self):
+        with self._wake_lock:
+            try:
+                self._wake.send(b'', zmq.NOBLOCK)
+            except zmq.Again:
+                pass  # the thread has wake-ups pending already
+
+    def _run(self):
+        self._clients = []
+        poll = zmq.Poller()
+        poll.register(self._control, zmq.POLLIN)
+
+        for endpoint in self.endpoints:
+            client = self.context.socket(zmq.DEALER)
+            client.setsockopt(zmq.LINGER, 0)
+            client.setsockopt(zmq.IMMEDIATE, 1)  # sending fails until connected
+            client.connect(endpoint)
+            poll.register(client, zmq.POLLIN)
+            self._clients.append(client)
+
+        while self.is_looping.is_set():
+            timeout = None
+            if self._pending:
+                deadline = next(iter(self._pending.values()))[2]
+                timeout = max(0, 1e3 * (deadline - time.time()))
+
+            socks = dict(poll.poll(timeout))
+
+            if socks.get(self._control) == zmq.POLLIN:
+                while self._control.poll(0):
+                    self._control.recv()
+                self._send_outgoing()
+
+            for client in self._clients:
+                if socks.get(client) == zmq.POLLIN:
+                    self._receive_replies(client)
+
+            self._resend_expired()
+
+        for client in self._clients:
+            client.close()
+        for entry in self._pending.values():
+            entry[0].set_exception(ConnectionError('client closed', 0))
+        self._pending.clear()
+
+        # submitted but never sent
+        while True:
+            try:
+                request_id, request, future = self._outgoing.get_nowait()
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ConnectionError('client closed', 0))
+
+    def _send(self, request_id, request, endpoint):
+        """Send to the server at index endpoint, or the next connected one. Returns the
+        index of the server used.
+        """
+        for i in range(len(self._clients)):
+            index = (endpoint + i) % len(self._clients)
+            try:
+                self._clients[index].send_multipart([request_id, b'', request], zmq.NOBLOCK)
+                return index
+            except zmq.Again:
+                continue
+
+        # no server connected, the request times out and is retried
+        return endpoint
+
+    def _send_outgoing(self):
+        while True:
+            try:
+                request_id, request, future = self._outgoing.get_nowait()
+            except queue.Empty:
+                break
+
+            # cancelled before it was sent, or claimed so that it cannot be cancelled while
+            # the thread resolves it
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            # spread the requests over the servers
+            endpoint = struct.unpack(">Q", request_id)[0] % len(self._clients)
+            endpoint = self._send(request_id, request, endpoint)
+
+            deadline = time.time() + 1e-3 * self.REQUEST_TIMEOUT
+            self._pending[request_id] = [future, request, deadline, self.REQUEST_RETRIES, endpoint]
+
+    def _receive_replies(self, client):
+        while True:
+            try:
+                request_id, _, reply = client.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+            reply = pickle.loads(reply)
+            if not reply:
+                logger.info("E: Malformed reply from server: %s", reply)
+                continue
+
+            # late replies to requests that were resent are dropped
+            entry = self._pending.pop(request_id, None)
+            if entry is not None:
+                entry[0].set_result(reply)
+
+    def _resend_expired(self):
+        now = time.time()
+        while self._pending:
+            request_id, entry = next(iter(self._pending.items()))
+            future, request, deadline, retries_left, endpoint = entry
+            if deadline > now:
+                break
+
+            del self._pending[request_id]
+
+            entry[3] = retries_left = retries_left - 1
+            if retries_left == 0:
+                logger.info("E: Server seems to be offline, abandoning")
+                future.set_exception(ConnectionError(', '.join(self.endpoints)+' is offline', 0))
+                continue
+
+            # to the next server, back at the end with the latest deadline
+            logger.info("W: No response from server, resending")
+            entry[4] = self._send(request_id, request, endpoint + 1)
+            entry[2] = now + 1e-3 * self.REQUEST_TIMEOUT
+            self._pending[request_id] = entry
+
+    def close(self):
+        self.is_looping.clear()
+        self._signal()
+        self._thread.join()
+        self._wake.close()
+        self._control.close()
+        self.context.term()
+
+
+class AsyncPublisher(object):
+    """asyncio version of Publisher.
+    """
+    def __init__(self, port=8765, raw_arrays=True, serializer=None, zero_copy=False):
+        super(AsyncPublisher, self).__init__()
+        self.raw_arrays = raw_arrays
+        self.zero_copy = zero_copy
+        self.serializer = serialization.get_serializer(serializer)
+        self.context = zmq.asyncio.Context()
+        self.socket = self.context.socket(zmq.PUB)
+        self.socket.bind("tcp://127.0.0.1:{}".format(port))
+
+    async def send_message(self, header, message):
+        frames = encode_message(header, message, self.raw_arrays, self.serializer,
+            copy=not self.zero_copy)
+        return await self.socket.send_multipart(frames, copy=False, track=self.zero_copy)
+
+    def close(self):
+        self.socket.close()
+        self.context.term()
+
+
+class AsyncSubscriber(object):
+    """asyncio version of ThreadedSubscriber, iterate over it to receive the messages:
+
+        async for header, message in AsyncSubscriber(port):
+            ...
+
+    With local, the arrays overwritten in shared memory before being read are skipped
+    and counted in overwritten.
+    """
+    def __init__(self, port=8765, topics=None, local=False):
+        super(AsyncSubscriber, self).__init__()
+        self.port = port
+        self.topics = [""] if topics is None else list(topics)
+        self.endpoint = local_endpoint(port) if local else "tcp://127.0.0.1:{}".format(port)
+        self.rings = {}
+        self.overwritten = 0
+
+        self.context = zmq.asyncio.Context()
+        self.socket = self.context.socket(zmq.SUB)
+        self.socket.connect(self.endpoint)
+        for t in self.topics:
+            self.socket.setsockopt_string(zmq.SUBSCRIBE, six.text_type(t))
+
+    async def recv(self):
+        """Returns the next [header, message].
+        """
+        while True:
+            frames = await self.socket.recv_multipart(copy=False)
+            message = decode_message(frames, self.rings)
+            if message is not None:
+                return message
+            self.overwritten += 1
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.recv()
+
+    def close(self):
+        self.socket.close()
+        self.context.term()
+        for ring in self.rings.values():
+            ring.close()
+        self.rings.clear()
+
+
+class AsyncLPClient(object):
+    """asyncio version of LPClient, with the same timeout, retries and reconnection.
+
+    Concurrent requests each use their own REQ socket, taken from a pool of idle sockets,
+    so that many of them can wait on the same event loop.
+    """
+    def __init__(self,
+        server,
+        port,
+        REQUEST_TIMEOUT = 2500,
+        REQUEST_RETRIES = 3,
+        ):
+
+        super(AsyncLPClient, self).__init__()
+
+        self.REQUEST_TIMEOUT = REQUEST_TIMEOUT
+        self.REQUEST_RETRIES = REQUEST_RETRIES
+        self.SERVER_ENDPOINT = "tcp://"+server+":%s" % port
+
+        self.context = zmq.asyncio.Context()
+        self._idle = []
+
+    def _connect(self):
+        client = self.context.socket(zmq.REQ)
+        client.connect(self.SERVER_ENDPOINT)
+        return client
+
+    async def request(self, request):
+        """Send request and returns the reply of the server.
+        """
+        retries_left = self.REQUEST_RETRIES
+        client = self._idle.pop() if self._idle else self._connect()
+
+        try:
+            await client.send_pyobj(request)
+
+            while True:
+                if await client.poll(self.REQUEST_TIMEOUT) == zmq.POLLIN:
+                    reply = await client.recv_pyobj()
+                    if reply:
+                        self._idle.append(client)
+                        return reply
+                    logger.info("E: Malformed reply from server: %s", reply)
+
+                else:
+                    logger.info("W: No response from server, retrying")
+                    # Socket is confused. Close and remove it.
+                    client.setsockopt(zmq.LINGER, 0)
+                    client.close()
+                    client = None
+
+                retries_left -= 1
+                if retries_left == 0:
+                    logger.info("E: Server seems to be offline, abandoning")
+                    raise ConnectionError(self.SERVER_ENDPOINT+' is offline', 0)
+
+                logger.info("I: Reconnecting and resending (%s)", request)
+                client = client or self._connect()
+                await client.send_pyobj(request)
+
+        except BaseException:
+            # also on cancellation, the socket may be waiting for a reply
+            if client is not None and not client.closed:
+                client.setsockopt(zmq.LINGER, 0)
+                client.close()
+            raise
+
+    def term(self):
+        for client in self._idle:
+            client.close()
+        self._idle = []
+        self.context.term()
+
+
+def benchmark_transport(sizes=(2**10, 2**14, 2**18, 2**22, 2**26), number=10, port=8765):
+    """Print the throughput of Publisher for float64 arrays of the given sizes in bytes,
+    sent as raw buffers, copied or not, pickled, and through shared memory.
+    """
+    modes = [
+        ("raw", dict(raw_arrays=True)),
+        ("zero-copy", dict(raw_arrays=True, zero_copy=True)),
+        ("pickle", dict(raw_arrays=False, serializer='pickle')),
+        # a ring of 2 slots of the size of the message, see SharedMemoryRing
+        ("shm", dict(local=True, slots=2)),
+    ]
+    print("{:>10} ".format("bytes") + " ".join("{:>14}".format(m + " MB/s") for m, kwargs in modes))
+
+    for size in sizes:
+        message = np.random.randn(size // 8)
+        rates = []
+
+        for mode, kwargs in modes:
+            if kwargs.get('local'):
+                kwargs = dict(kwargs, slot_size=size)
+            try:
+                publisher = Publisher(port, **kwargs)
+            except OSError as e:
+                logger.warning("%s skipped: %s", mode, e)
+                rates.append(np.nan)
+                continue
+            subscriber = publisher.context.socket(zmq.SUB)
+            subscriber.connect(publisher.endpoint)
+            subscriber.setsockopt_string(zmq.SUBSCRIBE, "")
+            rings = {}
+
+            # wait for the subscription to reach the publisher
+            while not subscriber.poll(10):
+                publisher.send_message("warmup", None)
+            while subscriber.poll(100):
+                subscriber.recv_multipart()
+
+            start = time.time()
+            for i in range(number):
+                publisher.send_message("bench", message)
+                decode_message(subscriber.recv_multipart(copy=False), rings)
+            rates.append(size * number / (time.time() - start) / 1e6)
+
+            subscriber.close()
+            for ring in rings.values():
+                ring.close()
+            publisher.close()
+
+        print("{:>10} ".format(size) + " ".join("{:>14.1f}".format(r) for r in rates))